@@ -0,0 +1,555 @@
+"""
+Fast paths held against their slow references: error bounds and speedups.
+
+Every check runs a reference (per-pixel ``colorsys`` / ``QColor`` code, the
+legacy per-pixel functions, scipy, brute force) and the fast implementation
+on crops of the sample images and on random uint8 inputs, and fails when the
+max or mean error goes over its bound or the fast path is not at least
+``speedup`` times faster.  A check without ``speedup`` holds the fast path
+to its error bounds alone: its speed is reported in parentheses, for
+information, and never fails it.  Property checks run seeded random cases around
+the edges: greys, saturated primaries, hues wrapping at 360.
+
+    QT_QPA_PLATFORM=offscreen python accuracy.py [--quick] [--only hsv]
+"""
+import argparse
+import colorsys
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QImage
+from PyQt5.QtWidgets import QApplication
+
+from utils import QColor
+from widgets.histogram import HistogramWidget
+from widgets.operations import OPERATIONS, apply_chain
+from widgets.parallel import ProcessBackend, SharedArray
+from widgets.processing import (
+    _bilateral, _hsv_to_rgb, _median, _rgb_to_hsv, _rgb_to_lab, _shift_hsv, array_image, pixels,
+    shift_old_hsv, warm_up,
+)
+from widgets.quantize import _features, _quantize, weighted_kmeans
+from widgets.region import ColorPlanes
+from widgets.strips import process_strips
+from widgets.sweep import Sweep, parameter_grid
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+Result = namedtuple("Result", "name max_error mean_error speedup minimum passed")
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def best_time(function, *args, repeat=3):
+    result, best = timed(function, *args)
+    for _ in range(repeat - 1):
+        best = min(best, timed(function, *args)[1])
+    return result, best
+
+
+def sample_images(size: int):
+    """
+    Central crops of the images next to main.py and random noise, RGBA uint8.
+    """
+    crops = []
+    for fname in sorted(glob.glob(os.path.join(ROOT, "*.jpg")) + glob.glob(os.path.join(ROOT, "*.png"))):
+        rgb = pixels(QImage(fname))
+        top, left = max((rgb.shape[0] - size) // 2, 0), max((rgb.shape[1] - size) // 2, 0)
+        crops.append((os.path.basename(fname), rgb[top:top + size, left:left + size].copy()))
+    rng = np.random.default_rng(0)
+    crops.append(("random", rng.integers(0, 256, (size, size, 4), dtype=np.uint8)))
+    return crops
+
+
+def display_image() -> np.ndarray:
+    """
+    The first image next to main.py scaled to the size it is shown at, RGBA uint8.
+    """
+    fname = sorted(glob.glob(os.path.join(ROOT, "*.jpg")) + glob.glob(os.path.join(ROOT, "*.png")))[0]
+    return pixels(QImage(fname).scaled(960, 540))
+
+
+def edge_colours() -> np.ndarray:
+    """
+    Greys, black and white, primaries and secondaries, colours next to them.
+    """
+    greys = [(v, v, v) for v in range(256)]
+    corners = [(r, g, b) for r in (0, 255) for g in (0, 255) for b in (0, 255)]
+    near = [(255, 0, 1), (255, 1, 0), (254, 255, 255), (1, 0, 0), (0, 1, 1), (128, 127, 127)]
+    colours = np.array(greys + corners + near, dtype=np.uint8)
+    alpha = np.full((len(colours), 1), 255, dtype=np.uint8)
+    return np.concatenate([colours, alpha], axis=1)[None]
+
+
+def random_colours(seed: int, count: int = 4096) -> np.ndarray:
+    """
+    Colours of one of several distributions, picked by `seed`.
+    """
+    rng = np.random.default_rng(seed)
+    kind = seed % 4
+    if kind == 0:
+        rgb = rng.integers(0, 256, (count, 3))
+    elif kind == 1:
+        # almost grey
+        rgb = rng.integers(1, 255, (count, 1)) + rng.integers(-1, 2, (count, 3))
+    elif kind == 2:
+        # reds around the 0 / 360 hue seam
+        rgb = np.column_stack([rng.integers(128, 256, count), rng.integers(0, 8, count), rng.integers(0, 8, count)])
+    else:
+        # extremes of every channel
+        rgb = rng.choice([0, 1, 254, 255], (count, 3))
+    rgba = np.concatenate([np.clip(rgb, 0, 255), np.full((count, 1), 255)], axis=1)
+    return rgba.astype(np.uint8)[None]
+
+
+# references, one pixel at a time
+
+def reference_rgb_to_hsv(rgb: np.ndarray) -> np.ndarray:
+    flat = rgb.reshape(-1, rgb.shape[-1])
+    hsv = np.array([colorsys.rgb_to_hsv(r / 255, g / 255, b / 255) for r, g, b in flat[:, :3].tolist()])
+    return (hsv * [360, 100, 100]).reshape(rgb.shape[:-1] + (3,))
+
+
+def reference_hsv_to_rgb(hsv: np.ndarray) -> np.ndarray:
+    flat = hsv.reshape(-1, 3) / [360, 100, 100]
+    rgb = np.array([colorsys.hsv_to_rgb(h, s, v) for h, s, v in flat.tolist()])
+    return (rgb * 255).reshape(hsv.shape)
+
+
+def reference_shift_hsv(rgb: np.ndarray, dh, ds, dv) -> np.ndarray:
+    out = rgb.copy()
+    flat = out.reshape(-1, rgb.shape[-1])
+    for pixel in flat:
+        h, s, v = colorsys.rgb_to_hsv(*(pixel[:3] / 255))
+        h = (h * 360 + dh) % 360
+        s = min(max(s * 100 + ds, 0), 100)
+        v = min(max(v * 100 + dv, 0), 100)
+        pixel[:3] = np.clip(np.array(colorsys.hsv_to_rgb(h / 360, s / 100, v / 100)) * 255, 0, 255)
+    return out
+
+
+def legacy_shift_hsv(rgb: np.ndarray, dh) -> np.ndarray:
+    image = array_image(rgb.copy()).convertToFormat(QImage.Format_ARGB32)
+    for _ in shift_old_hsv(image, dh, 0, 0):
+        pass
+    return pixels(image)
+
+
+def reference_lab(rgb: np.ndarray) -> np.ndarray:
+    flat = rgb.reshape(-1, rgb.shape[-1])[:, :3].tolist()
+    return np.array([QColor(r, g, b).lab() for r, g, b in flat]).reshape(rgb.shape[:-1] + (3,))
+
+
+def reference_bilateral(rgb: np.ndarray, sigma_s, sigma_r=25) -> np.ndarray:
+    radius = int(3 * sigma_s)
+    out = rgb.copy()
+    y, x = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    spatial = np.exp(-(x ** 2 + y ** 2) / (2 * sigma_s ** 2))
+    for c in range(3):
+        plane = np.pad(rgb[..., c].astype(np.float64), radius, mode="edge")
+        result = np.zeros(rgb.shape[:2])
+        for row in range(rgb.shape[0]):
+            for col in range(rgb.shape[1]):
+                window = plane[row:row + 2 * radius + 1, col:col + 2 * radius + 1]
+                weights = spatial * np.exp(-(window - plane[row + radius, col + radius]) ** 2 / (2 * sigma_r ** 2))
+                result[row, col] = (weights * window).sum() / weights.sum()
+        out[..., c] = np.clip(np.round(result), 0, 255)
+    return out
+
+
+def legacy_bilateral(rgb: np.ndarray, sigma_s, sigma_r=25) -> np.ndarray:
+    # the full resolution Durand-Dorsey the bilateral grid replaced: the plane
+    # filtered against fixed intensity levels with box blurs, interpolated
+    from scipy.ndimage import uniform_filter1d
+
+    size = int(round((4 * sigma_s ** 2 + 1) ** 0.5)) | 1
+    sigma_r = float(sigma_r)
+    levels = np.linspace(0, 255, max(2, int(np.ceil(255 / sigma_r)) + 1))
+    values = np.arange(256, dtype=np.float32)
+    out = rgb.copy()
+    for c in range(3):
+        plane = rgb[..., c]
+        result = np.zeros(plane.shape, np.float32)
+        for k, level in enumerate(levels):
+            interp = np.clip(1 - np.abs(values / (levels[1] - levels[0]) - k), 0, None)[plane]
+            weight = np.exp(-(values - level) ** 2 / (2 * sigma_r ** 2))[plane]
+            num, den = weight * plane, weight
+            for axis in (0, 1):
+                for _ in range(3):
+                    num = uniform_filter1d(num, size, axis=axis, mode="nearest")
+                    den = uniform_filter1d(den, size, axis=axis, mode="nearest")
+            result += interp * num / np.maximum(den, 1e-6)
+        out[..., c] = np.clip(result + 0.5, 0, 255)
+    return out
+
+
+def reference_median(rgb: np.ndarray, radius) -> np.ndarray:
+    from scipy.ndimage import median_filter
+    out = rgb.copy()
+    for c in range(3):
+        out[..., c] = median_filter(rgb[..., c], size=2 * radius + 1, mode="nearest")
+    return out
+
+
+def reference_quantize(rgb: np.ndarray, k) -> np.ndarray:
+    # k-means over every pixel, nothing binned
+    colours = rgb[..., :3].reshape(-1, 3).astype(np.float64)
+    labels, _ = weighted_kmeans(_features(colours, 255, "Lab"), np.ones(len(colours)), k)
+    palette = np.stack([np.bincount(labels, colours[:, c]) for c in range(3)], axis=1)
+    palette /= np.maximum(np.bincount(labels), 1)[:, None]
+    out = rgb.copy()
+    out[..., :3] = np.round(palette[labels]).reshape(rgb.shape[:2] + (3,))
+    return out
+
+
+# errors
+
+def hue_error(a: np.ndarray, b: np.ndarray, saturation: np.ndarray) -> np.ndarray:
+    # a hue is an angle, and it means nothing without saturation
+    error = np.abs(a - b) % 360
+    return np.where(saturation > 0, np.minimum(error, 360 - error), 0)
+
+
+def hsv_error(reference: np.ndarray, fast: np.ndarray) -> np.ndarray:
+    return np.concatenate([
+        hue_error(reference[..., 0], fast[..., 0], reference[..., 1]).ravel(),
+        np.abs(reference[..., 1:3] - fast[..., 1:3]).ravel(),
+    ])
+
+
+def channel_error(reference: np.ndarray, fast: np.ndarray) -> np.ndarray:
+    return np.abs(reference[..., :3].astype(np.float64) - fast[..., :3]).ravel()
+
+
+class Harness:
+    def __init__(self, quick: bool = False, only: str = None):
+        self.size = 48 if quick else 96
+        self.quick = quick
+        self.only = only
+        self.results = []
+
+    def selected(self, name) -> bool:
+        return not self.only or self.only in name
+
+    def check(self, name, reference, fast, inputs, error, max_error, mean_error=None, speedup=None):
+        if not self.selected(name):
+            return
+
+        errors, reference_time, fast_time = [], 0, 0
+        for args in inputs:
+            expected, took = timed(reference, *args)
+            reference_time += took
+            actual, took = best_time(fast, *args)
+            fast_time += took
+            errors.append(error(expected, actual))
+
+        errors = np.concatenate(errors)
+        worst, mean = errors.max(initial=0), errors.mean() if errors.size else 0
+        ratio = reference_time / max(fast_time, 1e-9)
+        passed = (
+            worst <= max_error
+            and (mean_error is None or mean <= mean_error)
+            and (speedup is None or ratio >= speedup)
+        )
+        self.results.append(Result(name, worst, mean, ratio, speedup, passed))
+
+    def check_property(self, name, holds, cases):
+        """
+        `holds(*case)` is the largest violation (0 when the property holds).
+        """
+        if not self.selected(name):
+            return
+        worst, failing = 0, None
+        for seed, case in enumerate(cases):
+            violation = holds(*case)
+            if violation > worst:
+                worst, failing = violation, seed
+        self.results.append(Result(
+            name if failing is None else "{} (case {})".format(name, failing), worst, 0, None, None, worst == 0
+        ))
+
+    def report(self) -> str:
+        lines = ["{:<44} {:>10} {:>10} {:>9} {:>7}  {}".format(
+            "check", "max err", "mean err", "speedup", "floor", "")]
+        for result in self.results:
+            if result.speedup is None:
+                speedup = "-"
+            elif result.minimum is None:
+                speedup = "({:.1f}x)".format(result.speedup)
+            else:
+                speedup = "{:.1f}x".format(result.speedup)
+            lines.append("{:<44} {:>10.4g} {:>10.4g} {:>9} {:>7} {}".format(
+                result.name, result.max_error, result.mean_error, speedup,
+                "-" if result.minimum is None else "{:g}x".format(result.minimum),
+                "ok" if result.passed else "FAIL",
+            ))
+        lines.append("speedups in parentheses are for information, they have no floor")
+        return "\n".join(lines)
+
+    @property
+    def passed(self) -> bool:
+        return all(result.passed for result in self.results)
+
+
+def run_checks(harness: Harness):
+    images = sample_images(harness.size)
+    seeds = range(8 if harness.quick else 32)
+    colour_sets = [edge_colours()] + [random_colours(seed, 1024) for seed in seeds]
+    pictures = [(rgb,) for _, rgb in images]
+
+    harness.check(
+        "rgb -> hsv vs colorsys", reference_rgb_to_hsv, lambda rgb: _rgb_to_hsv(rgb)[..., :3],
+        [(rgb,) for rgb in colour_sets] + pictures, hsv_error, 1e-9, speedup=10,
+    )
+
+    rng = np.random.default_rng(1)
+    hsv_sets = [(np.column_stack([rng.uniform(0, 360, 4096), rng.uniform(0, 100, (4096, 2))]),)]
+    hsv_sets.append((np.array([[h, s, v] for h in (0, 60, 120, 180, 240, 300, 359.999)
+                               for s in (0, 100) for v in (0, 100)], dtype=np.float64),))
+    harness.check(
+        "hsv -> rgb vs colorsys", reference_hsv_to_rgb, _hsv_to_rgb,
+        hsv_sets, lambda a, b: np.abs(a - b).ravel(), 1e-9, speedup=3,
+    )
+
+    shifts = [(30, 0, 0), (-45, 20, -10), (359, 0, 0), (180, -100, 0), (0, 0, 100)]
+    harness.check(
+        "shift hsv vs colorsys", reference_shift_hsv, _shift_hsv,
+        [(rgb, *shift) for rgb in colour_sets[:3] for shift in shifts]
+        + [(rgb, *shifts[1]) for _, rgb in images[:2]],
+        channel_error, 1, mean_error=0.3, speedup=20,
+    )
+
+    harness.check(
+        "shift hsv vs shift_old_hsv (hue)", legacy_shift_hsv, lambda rgb, dh: _shift_hsv(rgb, dh, 0, 0),
+        [(rgb, dh) for _, rgb in images[:3] for dh in (30, -90, 200)],
+        channel_error, 6, mean_error=1, speedup=5,
+    )
+
+    harness.check(
+        "rgb -> lab vs QColor.lab", reference_lab, _rgb_to_lab,
+        [(rgb,) for rgb in colour_sets[:3]] + pictures[:2],
+        lambda a, b: np.abs(a - b).ravel(), 0.01, speedup=20,
+    )
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    holder = type("Holder", (), {"status": lambda self, msg, sec=0: None})()
+
+    def histogram(method):
+        def run(rgb):
+            widget = HistogramWidget(holder)
+            image = array_image(rgb)
+            with contextlib.redirect_stdout(io.StringIO()):
+                getattr(widget, method)(image)
+            # the legacy version never normalises the last bin
+            return np.array([widget.r, widget.g, widget.b], dtype=np.float64)[:, :255]
+        return run
+
+    harness.check(
+        "histogram vs _calc_image", histogram("_calc_image"), histogram("calc_image"),
+        pictures, lambda a, b: np.abs(a - b).ravel(), 1e-12, speedup=10,
+    )
+
+    def region_reference(rgb, rects):
+        return np.array([
+            [rgb[r.top():r.bottom() + 1, r.left():r.right() + 1, :3].reshape(-1, 3).astype(np.float64).mean(axis=0),
+             rgb[r.top():r.bottom() + 1, r.left():r.right() + 1, :3].reshape(-1, 3).astype(np.float64).std(axis=0)]
+            for r in rects
+        ])
+
+    def region_fast(rgb, rects):
+        planes = ColorPlanes(array_image(rgb))
+        return np.array([planes.mean_std(r) for r in rects])
+
+    rects = [QRect(x, y, w, h) for x, y, w, h in rng.integers(1, harness.size // 2, (64, 4))]
+    # no speed floor: building the tables costs more than these few small
+    # regions, they pay off over the queries of a drag
+    harness.check(
+        "region mean/std vs numpy", region_reference, region_fast,
+        [(rgb, rects) for rgb in (pictures[0][0], pictures[-1][0])],
+        lambda a, b: np.abs(a - b).ravel(), 1e-6,
+    )
+
+    big = images[0][1] if harness.quick else np.tile(images[0][1], (3, 3, 1))
+    harness.check(
+        "median r=10 vs scipy", reference_median, _median,
+        [(big, 10)], channel_error, 0, speedup=1.2 if harness.quick else 1.5,
+    )
+    # no speed floor: scipy wins at small radii, the histogram median is
+    # there for large ones and held to exactness here
+    harness.check(
+        "median r=3 vs scipy", reference_median, _median,
+        [(rgb, 3) for _, rgb in images], channel_error, 0,
+    )
+
+    # at the size images are shown at, where a slow filter stalls the UI
+    display = display_image()
+    harness.check(
+        "median r=3 vs scipy, display size", reference_median, _median,
+        [(display, 3)], channel_error, 0, speedup=1.2,
+    )
+
+    # sigma 1 is summed over its window, sigma 2 goes through the bilateral
+    # grid, which rounds sharp edges a few levels differently
+    small = [(rgb[:32, :32].copy(), sigma) for _, rgb in images[:3] for sigma in (1, 2)]
+    harness.check(
+        "bilateral vs brute force", reference_bilateral, _bilateral,
+        small, channel_error, 16, mean_error=0.5, speedup=3,
+    )
+    harness.check(
+        "bilateral vs full resolution, display size", legacy_bilateral, _bilateral,
+        [(display, 2), (display, 8)], channel_error, 255, speedup=2.5,
+    )
+
+    def fit_ratio(rgb):
+        # how much worse the binned clustering fits than the per-pixel one
+        def error(reference, fast):
+            return np.array([channel_error(rgb, fast).mean() / max(channel_error(rgb, reference).mean(), 1e-9)])
+        return error
+
+    for name, rgb in images[:3]:
+        harness.check(
+            "quantize k=8 vs per-pixel ({})".format(name[:10]), lambda rgb: reference_quantize(rgb, 8),
+            lambda rgb: _quantize(rgb, 8), [(rgb,)], fit_ratio(rgb), 1.25, speedup=2,
+        )
+
+    chain = [("hsv", 30, 10, 0), ("median", 4), ("gaussian", 1.5), ("sobel",)]
+    src = np.tile(images[0][1], (4, 1, 1))
+
+    def strips(rgb):
+        out = np.zeros_like(rgb)
+        for _ in process_strips(rgb, out, chain, budget=rgb.shape[1] * 192 * 24):
+            pass
+        return out
+
+    # no speed floor: strips bound memory, they recompute halos and are slower
+    harness.check(
+        "strips vs whole image", lambda rgb: apply_chain(rgb.copy(), chain), strips,
+        [(src,)], channel_error, 0,
+    )
+
+    # no speed floor: what the workers gain depends on the cores there are;
+    # they write into a shared output, as for the server
+    for processes in (1, 2, 4):
+        name = "process backend x{} vs in process".format(processes)
+        if not harness.selected(name):
+            continue
+        backend = ProcessBackend(processes)
+        backend.warm_up()
+        out = SharedArray(*backend.output_layout(display, chain))
+        try:
+            harness.check(
+                name, lambda rgb: apply_chain(rgb, chain), lambda rgb: backend.apply(rgb, chain, out),
+                [(display,)], channel_error, 0,
+            )
+        finally:
+            out.close()
+            backend.close()
+
+    def sweep(name, variants):
+        def run(rgb):
+            return np.stack(Sweep(rgb).run(name, variants))
+        return run
+
+    def one_by_one(name, variants):
+        def run(rgb):
+            return np.stack([OPERATIONS[name][0](rgb, *args) for args in variants])
+        return run
+
+    # (name, variants, max error, speedup, speedup of the quick inputs); the
+    # blurs share little work, on the quick inputs the fixed costs outweigh it
+    sweeps = [
+        ("hsv", parameter_grid((-135, -45, 0, 45, 135), (-50, 0, 50), (-20, 0)), 1, 1.5, 1.5),
+        ("gaussian", [(sigma,) for sigma in (0.5, 1, 2, 3, 4, 6, 8)], 2, 1.2, None),
+        ("gabor", [(theta,) for theta in (0, 0.5, 1, 1.5, 2, 2.5, 3)], 0, 2, 2),
+    ]
+    for name, variants, max_error, speedup, quick_speedup in sweeps:
+        harness.check(
+            "sweep vs one by one ({})".format(name), one_by_one(name, variants), sweep(name, variants),
+            [(np.tile(images[0][1], (2, 2, 1)),)], channel_error, max_error,
+            speedup=quick_speedup if harness.quick else speedup,
+        )
+
+    # properties
+
+    def grey_has_no_hue(rgb):
+        hsv = _rgb_to_hsv(rgb)
+        grey = (rgb[..., 0] == rgb[..., 1]) & (rgb[..., 1] == rgb[..., 2])
+        return np.abs(hsv[..., :2][grey]).max(initial=0)
+
+    harness.check_property("greys have no hue or saturation", grey_has_no_hue, [(rgb,) for rgb in colour_sets])
+
+    def grey_stays_grey(rgb, dh, dv):
+        shifted = _shift_hsv(rgb, dh, 0, dv).astype(int)
+        grey = (rgb[..., 0] == rgb[..., 1]) & (rgb[..., 1] == rgb[..., 2])
+        return np.abs(shifted[grey][:, :3] - shifted[grey][:, :1]).max(initial=0)
+
+    harness.check_property("hue shifts keep greys grey", grey_stays_grey, [
+        (colour_sets[seed % len(colour_sets)], int(dh), int(dv))
+        for seed, (dh, dv) in enumerate(np.random.default_rng(2).integers(-720, 720, (len(seeds), 2)) // [1, 8])
+    ])
+
+    def primary_hues(_):
+        colours = np.array([[[255, 0, 0, 255], [255, 255, 0, 255], [0, 255, 0, 255],
+                             [0, 255, 255, 255], [0, 0, 255, 255], [255, 0, 255, 255]]], dtype=np.uint8)
+        hsv = _rgb_to_hsv(colours)[0, :, :3]
+        expected = np.array([[h, 100, 100] for h in (0, 60, 120, 180, 240, 300)])
+        return np.abs(hsv - expected).max()
+
+    harness.check_property("saturated primaries sit on their hues", primary_hues, [(None,)])
+
+    def full_turn(rgb, dh):
+        # the hue wraps at 360: a whole turn either way changes nothing
+        base = _shift_hsv(rgb, dh, 0, 0).astype(int)
+        return max(np.abs(_shift_hsv(rgb, dh + 360, 0, 0) - base).max(),
+                   np.abs(_shift_hsv(rgb, dh - 360, 0, 0) - base).max())
+
+    harness.check_property("hue wraps around at 360", full_turn, [
+        (rgb, dh) for rgb, dh in zip(colour_sets, np.random.default_rng(3).uniform(-360, 360, len(colour_sets)))
+    ])
+
+    def round_trip(rgb):
+        hsv = _rgb_to_hsv(rgb.astype(np.float64))
+        return np.abs(np.round(_hsv_to_rgb(hsv)[..., :3]) - rgb[..., :3]).max()
+
+    harness.check_property("rgb -> hsv -> rgb is lossless", round_trip, [(rgb,) for rgb in colour_sets])
+
+    def there_and_back(rgb, dh):
+        # rounding to uint8 on the way there and back, a level or so each
+        back = _shift_hsv(_shift_hsv(rgb, dh, 0, 0), -dh, 0, 0).astype(int)
+        return max(np.abs(back - rgb)[..., :3].max() - 3, 0)
+
+    harness.check_property("shifting the hue back restores colours", there_and_back, [
+        (rgb, dh) for rgb, dh in zip(colour_sets, np.random.default_rng(4).integers(-359, 360, len(colour_sets)))
+    ])
+
+    app.processEvents()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller inputs, fewer random cases")
+    parser.add_argument("--only", help="run the checks whose name contains this")
+    args = parser.parse_args()
+
+    # imports would count against the first reference that needs them
+    warm_up().join()
+
+    harness = Harness(args.quick, args.only)
+    run_checks(harness)
+    print(harness.report())
+    sys.exit(0 if harness.passed else 1)
+
+
+if __name__ == '__main__':
+    main()
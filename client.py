@@ -0,0 +1,97 @@
+"""
+Client of the processing server (``python -m widgets.server``).
+
+Needs numpy alone: no Qt, no scipy, nothing to start per call.
+
+    with Client() as client:
+        shifted = client.apply(rgba, ["hsv:30,0,0", "gaussian:2"])
+"""
+import json
+import socket
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from widgets.shm import attach
+
+DEFAULT_SOCKET = "/tmp/graphen.sock"
+
+
+class ServerError(Exception):
+    pass
+
+
+class Client:
+    def __init__(self, path: str = DEFAULT_SOCKET):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._file = self._socket.makefile("rwb")
+        self._input = None
+
+    def request(self, request: dict) -> dict:
+        self._file.write(json.dumps(request).encode() + b"\n")
+        self._file.flush()
+        response = json.loads(self._file.readline())
+        if not response.get("ok"):
+            raise ServerError(response.get("error"))
+        return response
+
+    def _input_segment(self, nbytes: int) -> shared_memory.SharedMemory:
+        # one segment reused while the frames fit in it
+        if self._input is None or self._input.size < nbytes:
+            self._close_input()
+            self._input = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        return self._input
+
+    def _close_input(self):
+        if self._input is not None:
+            self._input.close()
+            self._input.unlink()
+            self._input = None
+
+    def apply(self, array: np.ndarray, chain, key: str = None) -> np.ndarray:
+        """
+        `chain` is a list of operations as the command line takes them,
+        e.g. ``["hsv:30,0,0", "median:3"]``.  `key` identifies the input for
+        the result cache (the server hashes the pixels without it).
+        """
+        segment = self._input_segment(array.nbytes)
+        np.ndarray(array.shape, array.dtype, buffer=segment.buf)[...] = array
+
+        request = {
+            "cmd": "apply",
+            "chain": list(chain),
+            "input": {"shm": segment.name, "shape": list(array.shape), "dtype": array.dtype.str},
+        }
+        if key:
+            request["key"] = key
+        output = self.request(request)["output"]
+
+        shm = attach(output["shm"])
+        try:
+            return np.ndarray(tuple(output["shape"]), np.dtype(output["dtype"]), buffer=shm.buf).copy()
+        finally:
+            shm.close()
+
+    def apply_file(self, src: str, dst: str, chain, key: str = None):
+        """
+        Processes a ``.npy`` file into another one, pixels never copied here.
+        """
+        request = {"cmd": "apply", "chain": list(chain), "input": {"npy": src}, "output": {"npy": dst}}
+        if key:
+            request["key"] = key
+        self.request(request)
+
+    def stats(self) -> dict:
+        return self.request({"cmd": "stats"})
+
+    def close(self):
+        self._close_input()
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
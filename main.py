@@ -10,12 +10,16 @@ from PyQt5.QtGui import QIcon, QPixmap, QImage
 from PyQt5.QtWidgets import QApplication, QWidget, QAction, \
     qApp, QMainWindow, QFileDialog, QLabel, QHBoxLayout, QVBoxLayout, QSlider, QMenu, QBoxLayout, QRadioButton, \
     QButtonGroup, QCheckBox
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 
 from widgets import ImageWidget, HistogramWidget
+from widgets.cache import ImageCache
+from widgets.loader import ImageLoader
+from widgets.memory import accountant, parse_size, pool
 
-from utils import QColor
-from widgets.processing import shift_hsv
+from widgets.processing import shift_hsv, warm_up
+from widgets.session import SessionRecorder
+from widgets.sweep import ContactSheet, ContactSheetWidget, Sweep, format_arguments, parameter_grid
 
 
 class Separator:
@@ -28,6 +32,9 @@ class Program(QMainWindow):
     def __init__(self, *size):
         super().__init__()
 
+        self.loader = ImageLoader(ImageCache())
+        self.recorder: SessionRecorder = None
+
         self._init_ui(size)
 
     def _init_ui(self, size):
@@ -39,15 +46,36 @@ class Program(QMainWindow):
         self.program_widget = ProgramWidget(self)
         self.setCentralWidget(self.program_widget)
 
+        self.memory_label = QLabel("", self)
+        self.statusBar().addPermanentWidget(self.memory_label)
+        self._memory_timer = QTimer(self)
+        self._memory_timer.timeout.connect(self._show_memory)
+        self._memory_timer.start(1000)
+
         self.show()
         self.status("Ready")
 
+    def closeEvent(self, event):
+        # child widgets get no close event of their own
+        self.program_widget.image_widget.shutdown()
+        super().closeEvent(event)
+
+    def _show_memory(self):
+        self.memory_label.setText(accountant.report())
+
     def _open(self):
         fname = QFileDialog.getOpenFileName(self, 'Open file', os.getcwd())[0]
+        if not fname:
+            return
+        if self.recorder:
+            self.recorder.record("open", fname=os.path.abspath(fname))
 
-        image = QImage(fname)
+        image, size, future = self.loader.open(fname, self.program_widget.image_widget.size())
 
-        self.program_widget.set_image(image)
+        if future is None:
+            self.program_widget.set_image(image)
+        else:
+            self.program_widget.set_preview(image, size, future)
 
     def _save_generator(self, *args):
         def _():
@@ -56,7 +84,7 @@ class Program(QMainWindow):
         return _
 
     def _save_to(self, is_selected, colors):
-        if self.program_widget.image_widget.imageOrigin is None:
+        if not self.program_widget.image_widget.has_image:
             return
 
         text = "Save region " if is_selected else "Save image "
@@ -89,6 +117,12 @@ class Program(QMainWindow):
                 ("", Separator()),
                 ('&Exit', {'triggered': qApp.quit, 'shortcut': 'Ctrl+Q', 'icon': None}),
             ]),
+            ('&Sweep', [
+                ('Hue and saturation', lambda: self.program_widget.sweep("hsv")),
+                ('Gaussian σ', lambda: self.program_widget.sweep("gaussian")),
+                ('Gabor θ', lambda: self.program_widget.sweep("gabor")),
+                ('Quantization k', lambda: self.program_widget.sweep("quantize")),
+            ]),
         ]
 
     def _generate_menubar(self):
@@ -129,15 +163,27 @@ class Program(QMainWindow):
 
 
 class ProgramWidget(QWidget):
+    # operation: (arguments of every contact sheet cell, filter id)
+    SWEEPS = {
+        "hsv": (parameter_grid(range(-180, 180, 45), (-50, 0, 50)), 0),
+        "gaussian": ([(sigma / 2,) for sigma in range(1, 17)], 1),
+        "gabor": ([(theta / 10,) for theta in range(0, 32, 2)], 3),
+        "quantize": ([(k,) for k in (2, 3, 4, 5, 6, 8, 10, 12, 16, 20, 24, 32)], 6),
+    }
+    SWEEP_CELL = 240
+
     def __init__(self, parent):
         super().__init__(parent)
 
+        self.sheet_widget: ContactSheetWidget = None
+
         self.image_widget = ImageWidget(parent)
         self.hist_widget = HistogramWidget(parent)
         self.coord_label = QLabel("", self)
         self.pixel_rgb_label = QLabel('', self)
         self.pixel_hsv_label = QLabel('', self)
         self.pixel_lab_label = QLabel('', self)
+        self.hover_label = QLabel('', self)
 
         self.hsv_checkbox = QCheckBox("Shift HSV")
         self.hsv_checkbox.toggled.connect(self.slider_update)
@@ -157,6 +203,8 @@ class ProgramWidget(QWidget):
         self._set_default()
 
         self.image_widget.selection_update.connect(self.selection_upd)
+        self.image_widget.planes_ready.connect(lambda: self._region_labels(build=False))
+        self.image_widget.hover_update.connect(self.hover_upd)
 
         hbox = QHBoxLayout()
         hbox.addWidget(self.image_widget, 20)
@@ -167,6 +215,7 @@ class ProgramWidget(QWidget):
         vbox.addWidget(self.pixel_rgb_label)
         vbox.addWidget(self.pixel_hsv_label)
         vbox.addWidget(self.pixel_lab_label)
+        vbox.addWidget(self.hover_label)
 
         vbox.addWidget(self.hsv_checkbox)
         vbox.addLayout(h_slider_box)
@@ -200,9 +249,24 @@ class ProgramWidget(QWidget):
         self.filter_rbtn.addButton(radio4, 3)
         hbox.addWidget(radio4)
 
+        vbox.addLayout(hbox)
+        hbox = QHBoxLayout()
+
+        radio5 = QRadioButton("Медианный", self)
+        self.filter_rbtn.addButton(radio5, 4)
+        hbox.addWidget(radio5)
+
+        radio6 = QRadioButton("Билатеральный", self)
+        self.filter_rbtn.addButton(radio6, 5)
+        hbox.addWidget(radio6)
+
+        radio7 = QRadioButton("Квантование", self)
+        self.filter_rbtn.addButton(radio7, 6)
+        hbox.addWidget(radio7)
+
         vbox.addLayout(hbox)
 
-        slider_box, self.sigma_slider = self._get_slider_box("σ", 0, 10, 0.5, self._filter_change)
+        slider_box, self.sigma_slider = self._get_slider_box("σ", 0, 10, 5, self._filter_change)
 
         vbox.addLayout(slider_box)
         self.filter_rbtn.buttonClicked.connect(self._filter_change)
@@ -227,6 +291,24 @@ class ProgramWidget(QWidget):
             self.sigma_slider.setMinimum(0)
             self.sigma_slider.setMaximum(3600)
             self.sigma_slider.setTickInterval(50)
+        elif filter_id == 4:
+            self.sigma_slider.setEnabled(True)
+            self.sigma_slider.setText("r")
+            self.sigma_slider.setMinimum(10)
+            self.sigma_slider.setMaximum(300)
+            self.sigma_slider.setTickInterval(10)
+        elif filter_id == 5:
+            self.sigma_slider.setEnabled(True)
+            self.sigma_slider.setText("σ")
+            self.sigma_slider.setMinimum(10)
+            self.sigma_slider.setMaximum(200)
+            self.sigma_slider.setTickInterval(10)
+        elif filter_id == 6:
+            self.sigma_slider.setEnabled(True)
+            self.sigma_slider.setText("k")
+            self.sigma_slider.setMinimum(20)
+            self.sigma_slider.setMaximum(320)
+            self.sigma_slider.setTickInterval(10)
         else:
             self.sigma_slider.setText("-")
             self.sigma_slider.setDisabled(True)
@@ -267,6 +349,43 @@ class ProgramWidget(QWidget):
         else:
             self.image_widget.shift_hsv = [0, 0, 0]
 
+    def sweep(self, name):
+        if not self.image_widget.has_image:
+            return
+
+        variants, _ = self.SWEEPS[name]
+        if name == "hsv":
+            # the value shift stays as set
+            variants = [(dh, ds, self.v_slider.value()) for dh, ds in variants]
+        source = self.image_widget.sweep_source(shifted=name != "hsv")
+
+        self.window().status("Sweeping {} variants...".format(len(variants)))
+        results = Sweep.from_image(source, self.SWEEP_CELL).run(name, variants)
+        sheet = ContactSheet(results, [format_arguments(args) for args in variants])
+        for result in results:
+            pool.give(result)
+        self.window().status("Ready")
+
+        self.sheet_widget = ContactSheetWidget(sheet, "Sweep: {}".format(name))
+        self.sheet_widget.chosen.connect(lambda index: self._sweep_chosen(name, variants[index]))
+        self.sheet_widget.show()
+
+    def _sweep_chosen(self, name, args):
+        if name == "hsv":
+            for slider, value in zip((self.h_slider, self.s_slider, self.v_slider), args):
+                slider.setValue(value)
+            if self.hsv_checkbox.isChecked():
+                self.slider_update()
+            else:
+                self.hsv_checkbox.setChecked(True)  # updates through `toggled`
+            return
+
+        filter_id = self.SWEEPS[name][1]
+        self.filter_rbtn.button(filter_id).setChecked(True)
+        self._update_sigma_slider(filter_id)
+        self.sigma_slider.setValue(int(round(args[0] * 10)))
+        self._filter_change()
+
     def selection_upd(self):
         img = self.image_widget.selected(self.hist_widget.speed)
         print(img.width(), img.height())
@@ -277,32 +396,70 @@ class ProgramWidget(QWidget):
             coord.right(), coord.bottom()
         ))
 
-        if 1 == img.width() == img.height():
-            pixel = QColor(img.pixel(0, 0))
+        self._region_labels()
+        self.hist_widget.calc_image(img)
 
-            self.pixel_rgb_label.setText(
-                "R:{}, G:{}, B:{}".format(pixel.red(), pixel.green(), pixel.blue())
-            )
+    def _region_labels(self, build=True):
+        coord = self.image_widget.selection_img
+        if coord is None:
+            return
 
-            self.pixel_hsv_label.setText(
-                "H:{}, S:{}, V:{}".format(pixel.hue(), pixel.saturation(), pixel.value())
-            )
+        labels = [
+            (self.pixel_rgb_label, "RGB", "R:{}, G:{}, B:{}"),
+            (self.pixel_hsv_label, "HSV", "H:{}, S:{}, V:{}"),
+            (self.pixel_lab_label, "Lab", "L:{}, A:{}, B:{}"),
+        ]
 
-            self.pixel_lab_label.setText(
-                "L:{:.1f}, A:{:.1f}, B:{:.1f}".format(*pixel.lab())
+        for label, space, text in labels:
+            planes = self.image_widget.region_planes(space, build)
+            if planes is None:
+                if build or self.image_widget.building(space):
+                    label.setText("Calculating {}...".format(space))
+                else:
+                    # built and evicted right away, they do not fit the budget
+                    label.setText("{}: over memory budget".format(space))
+                continue
+
+            values = planes.mean_std(coord, space)
+            if values is None:
+                label.setText("Select pixels")
+            elif 1 == coord.width() == coord.height():
+                label.setText(text.format(*("{:.1f}".format(mean) for mean in values[0])))
+            else:
+                label.setText(text.format(*(
+                    "{:.1f}±{:.1f}".format(mean, std) for mean, std in zip(*values)
+                )))
+
+    def hover_upd(self, x, y):
+        rgb, hsv, lab = self.image_widget.pixel(x, y)
+        self.hover_label.setText(
+            "{}, {}\nR:{}, G:{}, B:{}\nH:{:.1f}, S:{:.1f}, V:{:.1f}\nL:{:.1f}, A:{:.1f}, B:{:.1f}".format(
+                x, y, *rgb, *hsv, *lab
             )
-        else:
-            self.pixel_rgb_label.setText("Select one pixel")
-            self.pixel_hsv_label.setText("Select one pixel")
-            self.pixel_lab_label.setText("Select one pixel")
-
-        self.hist_widget.calc_image(img)
+        )
 
     def set_image(self, image: QImage):
         self.image_widget.set_image(image)
 
+    def set_preview(self, preview: QImage, size, future):
+        self.image_widget.set_preview(preview, size, future)
+
 
 if __name__ == '__main__':
+    if "GRAPHEN_MEMORY" in os.environ:
+        accountant.budget = parse_size(os.environ["GRAPHEN_MEMORY"])
+
     app = QApplication(sys.argv)
     prg = Program(640, 480)
+
+    if "GRAPHEN_RECORD" in os.environ:
+        prg.recorder = SessionRecorder(prg.program_widget, os.environ["GRAPHEN_RECORD"])
+
+    if "GRAPHEN_STARTUP_PROFILE" in os.environ:
+        # startup_profile.py waits for this line, then the window closes
+        QTimer.singleShot(0, lambda: (print("window shown", flush=True), app.quit()))
+    else:
+        # filters import scipy on first use, by then it is loaded already
+        QTimer.singleShot(0, warm_up)
+
     sys.exit(app.exec_())
@@ -0,0 +1,59 @@
+"""
+Replays a recorded session headless and reports latency per interaction.
+
+Sessions are recorded with ``GRAPHEN_RECORD=session.jsonl python main.py``.
+
+    QT_QPA_PLATFORM=offscreen python replay_session.py session.jsonl --save after.json --baseline before.json
+"""
+import argparse
+import json
+import os
+import sys
+
+from PyQt5.QtWidgets import QApplication
+
+from main import Program
+from widgets.session import SessionReplayer, format_report, read_session
+
+
+def compare(report: dict, baseline: dict) -> str:
+    lines = ["{:>10} {:>9} {:>9} {:>7}".format("p95 ms", "before", "after", "ratio")]
+    for kind, row in report.items():
+        if kind in baseline:
+            before = baseline[kind]["p95"]
+            lines.append("{:>10} {:>9.2f} {:>9.2f} {:>6.2f}x".format(
+                kind, before, row["p95"], row["p95"] / before if before else float("inf")
+            ))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("session", help="recorded .jsonl session")
+    parser.add_argument("--speed", type=float, default=1, help="pace of the replay, 0 for no pauses")
+    parser.add_argument("--save", help="write the report as JSON")
+    parser.add_argument("--baseline", help="report of an earlier replay to compare p95 with")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QApplication(sys.argv)
+    program = Program(640, 480)
+
+    replayer = SessionReplayer(program.program_widget, args.speed)
+    replayer.play(read_session(args.session))
+    report = replayer.report()
+
+    print(format_report(report))
+    if args.baseline:
+        with open(args.baseline) as f:
+            print(compare(report, json.load(f)))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+
+    # closing every window stops the background work of the widgets too
+    app.closeAllWindows()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Time to first window of ``main.py`` and the imports it is spent on.
+
+Starts the program ``--runs`` times with ``-X importtime``, measures the
+wall time until the window is shown (the first run is the coldest one) and
+lists the slowest top-level imports of the last run.
+
+    python startup_profile.py --runs 5 --top 15
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+# the target for a cold start
+TARGET = 0.5
+
+_IMPORT_LINE = re.compile(r"import time:\s*(\d+) \|\s*(\d+) \|( *)(\S+)")
+
+
+def run_once():
+    env = dict(os.environ, GRAPHEN_STARTUP_PROFILE="1")
+    # -X importtime writes more than a pipe holds before the window shows,
+    # stderr goes to a file so the child never blocks on it
+    with tempfile.TemporaryFile("w+") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-X", "importtime", MAIN],
+            stdout=subprocess.PIPE, stderr=log, env=env, universal_newlines=True,
+        )
+        elapsed = None
+        for line in process.stdout:
+            if line.strip() == "window shown":
+                elapsed = time.perf_counter() - start
+                break
+        process.communicate()
+
+        log.seek(0)
+        stderr = log.read()
+    if elapsed is None:
+        raise RuntimeError("main.py exited before showing a window:\n" + stderr)
+    return elapsed, stderr
+
+
+def top_imports(stderr: str, count: int):
+    """
+    (cumulative seconds, module) of the imports done by main.py itself.
+    """
+    imports = []
+    for match in _IMPORT_LINE.finditer(stderr):
+        _, cumulative, indent, name = match.groups()
+        if len(indent) == 1:
+            imports.append((int(cumulative) / 1e6, name))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    args = parser.parse_args()
+
+    times, stderr = [], ""
+    for _ in range(args.runs):
+        elapsed, stderr = run_once()
+        times.append(elapsed)
+
+    print("Time to first window: first {:.3f}s, median {:.3f}s, best {:.3f}s (target {:.1f}s)".format(
+        times[0], statistics.median(times), min(times), TARGET
+    ))
+    print("Slowest imports:")
+    for seconds, name in top_imports(stderr, args.top):
+        print("  {:7.3f}s  {}".format(seconds, name))
+
+    if re.search(r"\| *scipy\b", stderr):
+        print("scipy was imported before the window, it should load on first use")
+
+    sys.exit(0 if times[0] < TARGET else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,12 @@
-from .image import ImageWidget
-from .histogram import HistogramWidget
+# the widgets load Qt, they are imported on first use so that modules such as
+# `widgets.shm` stay importable without it
+
+
+def __getattr__(name):
+    if name == "ImageWidget":
+        from .image import ImageWidget
+        return ImageWidget
+    if name == "HistogramWidget":
+        from .histogram import HistogramWidget
+        return HistogramWidget
+    raise AttributeError("module `{}` has no attribute `{}`".format(__name__, name))
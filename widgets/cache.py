@@ -0,0 +1,105 @@
+"""
+Disk cache of decoded images.
+
+Decoded pixels are kept in their own format as ``.npy`` files named after a
+hash of the file path, size and mtime, so reopening an image maps the cached
+pixels instead of decoding it again; the key takes a ``stat``, not a read of
+the file.  Files that were not used for the longest time are removed once
+the cache outgrows ``max_bytes``.
+"""
+import glob
+import hashlib
+import os
+from typing import Optional
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from .processing import array_image, native
+
+DEFAULT_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "graphen")
+DEFAULT_SIZE = 2 * 2 ** 30
+
+
+class ImageCache:
+    def __init__(self, root: str = DEFAULT_ROOT, max_bytes: int = DEFAULT_SIZE):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(fname: str) -> str:
+        stat = os.stat(fname)
+        identity = (os.path.abspath(fname), stat.st_size, stat.st_mtime_ns)
+        return hashlib.sha1(repr(identity).encode()).hexdigest()
+
+    def _path(self, key: str, name: str = "") -> str:
+        return os.path.join(self.root, key + (("." + name) if name else "") + ".npy")
+
+    def _load(self, path: str) -> Optional[np.ndarray]:
+        if not os.path.exists(path):
+            return None
+        os.utime(path)  # eviction goes by last use
+        # copy-on-write: writes to the pixels never reach the cache
+        return np.load(path, mmap_mode="c")
+
+    def _save(self, path: str, array: np.ndarray):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+        self.evict()
+
+    def load(self, key: str) -> Optional[QImage]:
+        # pixels are kept in their own format, named in the file name
+        for path in glob.glob(self._path(key, "format*")):
+            format = int(path[:-len(".npy")].rsplit(".format", 1)[1])
+            return array_image(self._load(path), QImage.Format(format))
+        return None
+
+    def store(self, key: str, image: QImage):
+        image = native(image)
+        height, width, depth = image.height(), image.width(), image.depth() // 8
+        ptr = image.constBits()
+        ptr.setsize(image.byteCount())
+        pixels = np.frombuffer(ptr, np.uint8).reshape(height, image.bytesPerLine())
+        pixels = pixels[:, :width * depth].reshape(height, width, depth)
+        self._save(self._path(key, "format{}".format(int(image.format()))), pixels)
+
+    def open(self, fname: str, key: str = None) -> QImage:
+        if not os.path.isfile(fname):
+            return QImage(fname)
+
+        key = key or self.key(fname)
+        image = self.load(key)
+        if image is None:
+            image = QImage(fname)
+            if not image.isNull():
+                self.store(key, image)
+        return image
+
+    def size(self) -> int:
+        return sum(os.path.getsize(os.path.join(self.root, name)) for name in os.listdir(self.root))
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.root):
+            # a .tmp is being written, maybe by another process
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
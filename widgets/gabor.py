@@ -1,8 +1,9 @@
+from functools import lru_cache
+
 import numpy as np
-from qimage2ndarray import array2qimage
-from scipy.signal import convolve2d
 
-from .processing import qimageview
+from .memory import pool
+from .processing import _apply
 
 
 def _sigma_prefactor(bandwidth):
@@ -12,6 +13,7 @@ def _sigma_prefactor(bandwidth):
         (2.0 ** b + 1) / (2.0 ** b - 1)
 
 
+@lru_cache(maxsize=64)
 def gabor_kernel(frequency, theta=0, bandwidth=1, sigma_x=None, sigma_y=None,
                  n_stds=3, offset=0):
     if sigma_x is None:
@@ -28,16 +30,20 @@ def gabor_kernel(frequency, theta=0, bandwidth=1, sigma_x=None, sigma_y=None,
     rotx = x * np.cos(theta) + y * np.sin(theta)
     roty = -x * np.sin(theta) + y * np.cos(theta)
 
-    g = np.zeros(y.shape, dtype=np.complex)
+    g = np.zeros(y.shape, dtype=complex)
     g[:] = np.exp(-0.5 * (rotx ** 2 / sigma_x ** 2 + roty ** 2 / sigma_y ** 2))
     g /= 2 * np.pi * sigma_x * sigma_y
     g *= np.exp(1j * (2 * np.pi * frequency * rotx + offset))
 
+    # the kernel is cached and shared by all callers
+    g.flags.writeable = False
     return g
 
 
 def _gabor(image, frequency, theta=0, bandwidth=1, sigma_x=None,
           sigma_y=None, n_stds=3, offset=0, mode='reflect', cval=0):
+    from scipy.signal import convolve2d
+
     g = gabor_kernel(frequency, theta, bandwidth, sigma_x, sigma_y, n_stds,
                      offset)
 
@@ -47,16 +53,33 @@ def _gabor(image, frequency, theta=0, bandwidth=1, sigma_x=None,
     return filtered_real, filtered_imag
 
 
-def gabor(image, theta):
-    rgb = qimageview(image.copy())
+def _gabor_rgb(rgb, theta):
+    real = pool.take(rgb.shape, rgb.dtype)
+    imag = pool.take(rgb.shape, rgb.dtype)
+
+    if rgb.ndim == 2:
+        real[...], imag[...] = _gabor(rgb, 1, theta=theta, mode="same")
+    else:
+        real[..., 0], imag[..., 0] = _gabor(rgb[..., 0], 1, theta=theta, mode="same")
+        real[..., 1], imag[..., 1] = _gabor(rgb[..., 1], 1, theta=theta, mode="same")
+        real[..., 2], imag[..., 2] = _gabor(rgb[..., 2], 1, theta=theta, mode="same")
 
-    real = np.zeros_like(rgb)
-    imag = np.zeros_like(rgb)
+    return _gabor_energy(rgb, real, imag)
 
-    real[..., 0], imag[..., 0] = _gabor(rgb[..., 0], 1, theta=theta, mode="same")
-    real[..., 1], imag[..., 1] = _gabor(rgb[..., 1], 1, theta=theta, mode="same")
-    real[..., 2], imag[..., 2] = _gabor(rgb[..., 2], 1, theta=theta, mode="same")
 
-    dist = (real ** 2 + imag ** 2)
-    dist[..., 3] = rgb[..., 3]
-    return array2qimage(dist)
+def _gabor_energy(rgb, real, imag):
+    # `real` and `imag` are pool buffers of the rgb dtype, they go back there
+    dist = pool.take(rgb.shape, rgb.dtype)
+    np.multiply(real, real, out=dist)
+    np.multiply(imag, imag, out=imag)
+    dist += imag
+    if rgb.ndim == 3:
+        dist[..., 3:] = rgb[..., 3:]
+
+    pool.give(real)
+    pool.give(imag)
+    return dist
+
+
+def gabor(image, theta):
+    return _apply(image, _gabor_rgb, theta)
@@ -2,12 +2,11 @@ import time
 from math import log
 
 import numpy as np
-from PyQt5.QtGui import QPainter, QPen, QPixmap, QImage
+from PyQt5.QtGui import QPainter, QPixmap, QImage
 from PyQt5.QtWidgets import QWidget
-from PyQt5.QtCore import Qt
+from qimage2ndarray import array2qimage
 
-from utils import QColor
-from .processing import qimageview
+from .processing import qimageview, native
 
 
 def timechecker(orig_func):
@@ -35,23 +34,29 @@ class HistogramWidget(QWidget):
         self.b = [0] * 256
         self.initUI()
         self.speed = 100000
+        self._rendered: QImage = None
 
     def set_status(self, msg, sec=0):
         self.parent.status(msg, sec)
 
     def initUI(self):
-        self.setMinimumSize(258, 16)
-        self.setMaximumWidth(258)
+        self.setMinimumSize(66, 16)
 
     @timechecker
     def calc_image(self, img: QImage):
-        rgb = qimageview(img)
+        rgb = qimageview(native(img))
+        if rgb.dtype == np.uint16:
+            rgb = rgb >> 8
+
         self.set_status("Calculating histogram... {:.1f}".format(0))
-        self.r = np.bincount(rgb[..., 0].flatten())
-        self.set_status("Calculating histogram... {:.1f}".format(25))
-        self.g = np.bincount(rgb[..., 1].flatten())
-        self.set_status("Calculating histogram... {:.1f}".format(50))
-        self.b = np.bincount(rgb[..., 2].flatten())
+        if rgb.ndim == 2:
+            self.r = self.g = self.b = np.bincount(rgb.flatten())
+        else:
+            self.r = np.bincount(rgb[..., 0].flatten())
+            self.set_status("Calculating histogram... {:.1f}".format(25))
+            self.g = np.bincount(rgb[..., 1].flatten())
+            self.set_status("Calculating histogram... {:.1f}".format(50))
+            self.b = np.bincount(rgb[..., 2].flatten())
         self.set_status("Calculating histogram... {:.1f}".format(75))
 
         mx = max(max(self.r), max(self.g), max(self.b))
@@ -67,13 +72,10 @@ class HistogramWidget(QWidget):
         if len(self.b) < 256:
             self.b = np.append(self.b, [0] * (256 - len(self.b)))
 
-        self.r = list(self.r)
-        self.g = list(self.g)
-        self.b = list(self.b)
-
         self.set_status("Calculating histogram... {:.1f}".format(100))
 
         self.set_status("Ready")
+        self._rendered = None
         self.update()
 
     @timechecker
@@ -103,46 +105,43 @@ class HistogramWidget(QWidget):
         self.b = b
 
         self.set_status("Ready")
+        self._rendered = None
         self.update()
 
+    def resizeEvent(self, e):
+        self._rendered = None
+
     def paintEvent(self, e):
+        if self._rendered is None:
+            self._rendered = self._render()
+
         qp = QPainter()
         qp.begin(self)
-        self._draw_widget(qp)
+        qp.drawImage(0, 0, self._rendered)
         qp.end()
 
-    def _draw_widget(self, qp):
-        size = self.size()
-        w = size.width()
-        h = size.height()
-
-        qp.setBrush(QColor(0, 0, 0))
-
-        qp.drawRect(0, 0, w - 1, h - 1)
-        rc = QColor(255, 0, 0)
-        gc = QColor(0, 255, 0)
-        bc = QColor(0, 0, 255)
-
-        for x in range(256):
-            values = [(self.r[x], rc), (self.g[x], gc), (self.b[x], bc)]
-
-            self._draw_v_line(qp, values, x + 1)
-
-    def _draw_v_line(self, qp, values, pos_x):
-        values.sort(key=lambda item: item[0])
-
-        first = values[0][1] + values[1][1] + values[2][1]
-        second = values[1][1] + values[2][1]
-        third = values[2][1]
-
-        colors = [first, second, third]
-
-        lines = [(0, values[0][0]), (values[0][0], values[1][0]), (values[1][0], values[2][0])]
-
-        qp.setBrush(Qt.NoBrush)
-        for (start, end), color in zip(lines, colors):
-            pen = QPen(color, 1, Qt.SolidLine)
-
-            qp.setPen(pen)
-            qp.drawLine(pos_x, (1 - start) * (self.height() - 3) + 1, pos_x, (1 - end) * (self.height() - 3) + 1)
-
+    def _render(self) -> QImage:
+        # Column of each bin is a stack of bars: a channel is lit at every
+        # level below its value, so where several are lit their colours add.
+        # Only the highest channel is lit at its own level.  The 256 bins
+        # are stretched over a wider widget and, in a narrower one, a column
+        # shows the highest of the bins it covers.
+        w = self.width()
+        h = self.height()
+
+        pixels = np.zeros((h, w, 3), dtype=np.uint8)
+
+        if w > 2 and h > 3:
+            values = np.array([self.r, self.g, self.b])[:, :256]
+            starts = np.arange(w - 2) * 256 // (w - 2)
+            values = np.maximum.reduceat(values, starts, axis=1)
+            tops = np.floor((1 - values) * (h - 3) + 1)
+            rows = np.arange(1, h - 1)
+
+            lit = rows[None, :, None] > tops[:, None, :]
+            highest = 2 - np.argmax(values[::-1], axis=0)
+            columns = np.arange(w - 2)
+            lit[highest, (tops[highest, columns] - 1).astype(int), columns] = True
+            pixels[1:-1, 1:-1] = np.moveaxis(lit, 0, -1) * np.uint8(255)
+
+        return array2qimage(pixels)
@@ -1,19 +1,27 @@
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
 
 from PyQt5 import QtGui
 
-from PyQt5.QtCore import QObject, pyqtSignal, QRect, QPoint, Qt
-from PyQt5.QtGui import QPainter, QPixmap, QImage
+from PyQt5.QtCore import QObject, pyqtSignal, QRect, QPoint, QSize, QTimer, Qt
+from PyQt5.QtGui import QPainter, QPixmap, QImage, QGuiApplication
 from PyQt5.QtWidgets import QWidget
 
 from utils import QColor, hsv_ranged
 from .gabor import gabor
-from .processing import shift_hsv, rgb_to_hsv, gaussian, sobel
+from .memory import accountant, nbytes
+from .region import ColorPlanes
+from .processing import native, shift_hsv, rgb_to_hsv, gaussian, sobel, median, bilateral
+from .quantize import quantize
 
 
 class Communicate(QObject):
 
     selection_update = pyqtSignal()
+    hover_update = pyqtSignal(int, int)
+    origin_loaded = pyqtSignal()
+    planes_ready = pyqtSignal()
 
 
 class ImageWidget(QWidget):
@@ -22,7 +30,18 @@ class ImageWidget(QWidget):
 
         self.parent = parent
 
-        self.imageOrigin: QImage = None
+        self._origin: QImage = None
+        self._origin_future: Future = None
+        self._origin_size: QSize = None
+        self._preview: QImage = None
+        self._rescaled_from_preview = False
+        self._planes: ColorPlanes = None
+        self._level_planes: ColorPlanes = None
+        # region statistics are built off the UI thread, one space at a time
+        self._planes_executor = ThreadPoolExecutor(max_workers=1)
+        # (planes, space) -> future of the tables being built
+        self._building = {}
+        self._closed = False
         self._rescaled_image: QImage = None
         self._shifted_image: QImage = None
         self._image: QImage = None
@@ -37,16 +56,144 @@ class ImageWidget(QWidget):
         self._communicate = Communicate()
 
         self.selection_update = self._communicate.selection_update
+        self.hover_update = self._communicate.hover_update
+        self._communicate.origin_loaded.connect(self._origin_loaded)
+        # the new planes count against the budget before anyone reads them
+        self._communicate.planes_ready.connect(accountant.enforce)
+        self.planes_ready = self._communicate.planes_ready
 
         self._init_ui()
 
         self.endMouse = True
 
         self._shift_hsv_values = [0, 0, 0]
+
+        accountant.register_cache("planes", self._planes_nbytes, self._drop_planes)
+        accountant.register_cache("display planes", self._level_planes_nbytes, self._drop_level_planes)
     
     def set_status(self, msg, sec=0):
         self.parent.status(msg, sec)
 
+    @property
+    def imageOrigin(self) -> QImage:
+        # full resolution pixels, waits for the background decode if needed
+        if self._origin_future is not None:
+            self.set_status("Loading full resolution...")
+            self._origin = self._origin_future.result()
+            self._origin_future = None
+            self._preview = None
+            accountant.track("origin", self._origin)
+        return self._origin
+
+    @imageOrigin.setter
+    def imageOrigin(self, image: QImage):
+        self._origin = image
+        self._origin_future = None
+        self._origin_size = None if image is None else image.size()
+        self._preview = None
+        self._planes = None
+        accountant.track("origin", self._origin)
+
+    @property
+    def planes(self) -> ColorPlanes:
+        # colour planes of the full resolution image, for region analysis
+        planes = self._planes
+        if planes is None:
+            planes = self._planes = ColorPlanes(self.imageOrigin)
+            accountant.enforce()
+        return planes
+
+    def region_planes(self, space: str, build: bool = True) -> Optional[ColorPlanes]:
+        """
+        The full resolution planes once the region statistics of `space` are
+        ready, else None; with `build` they are built in the background and
+        `planes_ready` is emitted when they are done.
+        """
+        planes = self.planes
+        if planes.ready(space):
+            return planes
+
+        if build and not self._closed and (planes, space) not in self._building:
+            future = self._building[planes, space] = self._planes_executor.submit(planes.prepare, space)
+
+            def done(_):
+                self._building.pop((planes, space), None)
+                self._emit("planes_ready")
+            future.add_done_callback(done)
+        return None
+
+    def building(self, space: str) -> bool:
+        return any(building == space for _, building in list(self._building))
+
+    def _emit(self, name: str):
+        # from worker threads, which may finish after the widget is gone
+        if self._closed:
+            return
+        try:
+            getattr(self._communicate, name).emit()
+        except RuntimeError:
+            pass
+
+    def shutdown(self):
+        """
+        Stops the background work: builds that did not start are cancelled,
+        a running one finishes without signalling.
+        """
+        self._closed = True
+        for future in list(self._building.values()):
+            future.cancel()
+        self._planes_executor.shutdown(wait=False)
+
+    def closeEvent(self, event):
+        self.shutdown()
+        super().closeEvent(event)
+
+    def _planes_nbytes(self) -> int:
+        return nbytes(self._planes)
+
+    def _level_planes_nbytes(self) -> int:
+        return nbytes(self._level_planes)
+
+    def _drop_planes(self):
+        # pinned while a selection reads them, or every selection update
+        # would build them again only to have them evicted
+        if self.selection_img is not None:
+            return
+        self._planes = None
+
+    def _drop_level_planes(self):
+        self._level_planes = None
+
+    def pixel(self, x: int, y: int):
+        """
+        RGB, HSV and Lab of the image pixel (x, y), an index into planes that
+        are already converted.  Until a selection has converted the full
+        resolution planes, they are read from the planes of the displayed
+        level (sampled from the image by nearest neighbour), converted whole
+        on the first hover after a rescale.
+        """
+        planes = self._planes
+        if planes is not None and planes.converted("HSV") and planes.converted("Lab"):
+            return planes.pixel(x, y)
+
+        planes = self._level_planes
+        if planes is None:
+            planes = self._level_planes = ColorPlanes(self._rescaled_image)
+            planes.plane("HSV"), planes.plane("Lab")
+            accountant.enforce()
+        x, y = self._to_level_xy(x, y)
+        return planes.pixel(min(x, planes.width - 1), min(y, planes.height - 1))
+
+    @property
+    def has_image(self) -> bool:
+        return self._origin is not None or self._origin_future is not None
+
+    def _display_origin(self) -> QImage:
+        # what to rescale for display: full resolution once it is decoded
+        if self._origin_future is not None and not self._origin_future.done():
+            return self._preview
+        return self.imageOrigin
+
     @property
     def shift_hsv(self):
         return tuple(self._shift_hsv_values)
@@ -67,6 +214,7 @@ class ImageWidget(QWidget):
 
         if self._shift_hsv_values == [0, 0, 0]:
             self._shifted_image = self._rescaled_image
+            accountant.track("shifted", self._shifted_image)
             return
 
         res = self._rescaled_image.width() * self._rescaled_image.height()
@@ -81,11 +229,16 @@ class ImageWidget(QWidget):
                 ))
 
         self._shifted_image: QImage = x
+        accountant.track("shifted", self._shifted_image)
 
         tm = time.time() - st
         print("Time: {:.2f}s".format(tm))
         print("Speed: {:.2f}Kpix/s".format(res / 1000 / tm))
 
+    def sweep_source(self, shifted: bool) -> QImage:
+        # sweeps try arguments on the displayed level, before or after the HSV shift
+        return self._shifted_image if shifted else self._rescaled_image
+
     def set_filter(self, filter_id, *args):
         self._filter_id = filter_id
         self._filter_args = args
@@ -106,9 +259,20 @@ class ImageWidget(QWidget):
             theta = self._filter_args[0]
 
             self._image = gabor(self._shifted_image, theta)
+        elif self._filter_id == 4:
+            radius = self._filter_args[0]
+            self._image = median(self._shifted_image, radius)
+        elif self._filter_id == 5:
+            sigma = self._filter_args[0]
+            self._image = bilateral(self._shifted_image, sigma)
+        elif self._filter_id == 6:
+            k = self._filter_args[0]
+            self._image = quantize(self._shifted_image, k)
         else:
             self._image = self._shifted_image
 
+        accountant.track("filtered", self._image)
+
     def get_image(self, is_selected, colors):
         if colors not in ["RGB", "HSV"]:
             raise ValueError("RGB, HSV, not `{}`".format(colors))
@@ -150,7 +314,23 @@ class ImageWidget(QWidget):
         )
 
     def to_image_coord(self, point: QPoint) -> QPoint:
-        return QPoint(point.x() * self.coef, point.y() * self.coef)
+        return QPoint(*self._to_image_xy(point.x(), point.y()))
+
+    def _to_image_xy(self, x, y):
+        return int(x * self.coef), int(y * self.coef)
+
+    def _to_level_xy(self, x, y):
+        # the inverse of `_to_image_xy`: the last widget (and level) pixel it
+        # takes to (x, y), found with the same expression so that a hovered
+        # pixel comes back as itself instead of being truncated twice
+        def back(value):
+            i = int(value / self.coef)
+            while int((i + 1) * self.coef) <= value:
+                i += 1
+            while i > 0 and int(i * self.coef) > value:
+                i -= 1
+            return i
+        return back(x), back(y)
 
     def from_image_rect(self, rect: QRect) -> QRect:
         return QRect(
@@ -159,10 +339,17 @@ class ImageWidget(QWidget):
         )
 
     def from_image_coord(self, point: QPoint) -> QPoint:
-        return QPoint(point.x() / self.coef, point.y() / self.coef)
+        return QPoint(int(point.x() / self.coef), int(point.y() / self.coef))
 
     def _init_ui(self):
         self.setMinimumSize(10, 10)
+        self.setMouseTracking(True)
+
+        self._selection_timer = QTimer(self)
+        self._selection_timer.setSingleShot(True)
+        refresh_rate = QGuiApplication.primaryScreen().refreshRate() or 60
+        self._selection_timer.setInterval(int(1000 / refresh_rate))
+        self._selection_timer.timeout.connect(self._emit_selection_update)
 
     def paintEvent(self, e):
         qp = QPainter()
@@ -180,10 +367,11 @@ class ImageWidget(QWidget):
         qp.setBrush(QColor(0, 0, 0))
         qp.setPen(QColor(0, 0, 0))
 
-        if self.imageOrigin is None:
+        if not self.has_image or self._image is None:
             qp.drawText(event.rect(), Qt.AlignCenter, "No image")
         else:
-            qp.drawImage(0, 0, self._image)
+            rect = event.rect()
+            qp.drawImage(rect, self._image, rect)
 
             self._draw_selection(qp)
 
@@ -197,10 +385,10 @@ class ImageWidget(QWidget):
         qp.drawRect(self.selection)
 
     def _rescale(self):
-        if self.imageOrigin is None:
+        if not self.has_image:
             return
 
-        if self.imageOrigin.height() == 0 or self.imageOrigin.width() == 0:
+        if self._origin_size.height() <= 0 or self._origin_size.width() <= 0:
             self.imageOrigin = None
             return
 
@@ -208,59 +396,114 @@ class ImageWidget(QWidget):
 
         aspect = self.width() / self.height()
 
-        aspect_image = self.imageOrigin.width() / self.imageOrigin.height()
+        aspect_image = self._origin_size.width() / self._origin_size.height()
+
+        origin = self._display_origin()
 
         if aspect_image > aspect:
-            self.coef = self.imageOrigin.width() / self.width()
-            _image = self.imageOrigin.scaledToWidth(self.width())
+            self.coef = self._origin_size.width() / self.width()
+            _image = native(origin.scaledToWidth(self.width()))
         else:
-            self.coef = self.imageOrigin.height() / self.height()
-            _image = self.imageOrigin.scaledToHeight(self.height())
+            self.coef = self._origin_size.height() / self.height()
+            _image = native(origin.scaledToHeight(self.height()))
 
         if self.selection is not None:
             self.selection = self.from_image_rect(self.selection_img)
 
         self._rescaled_image = _image
+        self._rescaled_from_preview = self._preview is not None and origin is self._preview
+        self._level_planes = None
+        accountant.track("rescaled", self._rescaled_image)
 
         self.set_status("Ready")
 
     def set_image(self, image: QImage):
         self.imageOrigin = image
+        self._refresh()
+
+    def set_preview(self, preview: QImage, size: QSize, future: Future):
+        self._origin = None
+        self._planes = None
+        self._origin_future = future
+        self._origin_size = size
+        self._preview = preview
+        accountant.track("origin", self._preview)
+        future.add_done_callback(lambda _: self._emit("origin_loaded"))
+        self._refresh()
+
+    def _origin_loaded(self):
+        # the preview may have been dropped already, when a selection took
+        # the full image, and the signal may be of an image opened before
+        if not self._rescaled_from_preview:
+            return
+        if self._origin_future is not None and not self._origin_future.done():
+            return
+        self._rescale()
+        self._do_shift_hsv()
+        self._apply_filter()
+        self.update()
+
+    def _refresh(self):
         self.selection = None
+        self.selection_img = None
         self.coef = None
         self._rescale()
         self._do_shift_hsv()
         self._apply_filter()
         self.update()
 
+    def _update_selection(self, old: QRect):
+        # repaint only what the old and the new selection cover
+        dirty = self.selection.normalized()
+        if old is not None:
+            dirty = dirty.united(old.normalized())
+        self.update(dirty.adjusted(-1, -1, 2, 2))
+
+    def _schedule_selection_update(self):
+        # at most one `selection_update` per display frame while dragging,
+        # it is handled with whatever the selection is by then
+        if not self._selection_timer.isActive():
+            self._selection_timer.start()
+
+    def _emit_selection_update(self):
+        self._selection_timer.stop()
+        self.selection_update.emit()
+
     def mousePressEvent(self, event):
-        if self.imageOrigin is None:
+        if not self.has_image:
             return
         if event.button() == Qt.LeftButton:
+            old = self.selection
             self.selection = QRect(event.pos(), event.pos())
             self.selection_img = self.to_image_rect(self.selection)
             self.endMouse = False
-            self.selection_update.emit()
-        self.update()
+            self._emit_selection_update()
+            self._update_selection(old)
 
     def mouseMoveEvent(self, event):
-        if self.imageOrigin is None:
+        if not self.has_image:
             return
         if event.buttons() == Qt.LeftButton:
+            old = QRect(self.selection)
             self.selection.setBottomRight(event.pos())
             self.selection_img = self.to_image_rect(self.selection)
-            self.selection_update.emit()
-        self.update()
+            self._schedule_selection_update()
+            self._update_selection(old)
+        elif event.buttons() == Qt.NoButton:
+            x, y = self._to_image_xy(event.x(), event.y())
+            if 0 <= x < self._origin_size.width() and 0 <= y < self._origin_size.height():
+                self.hover_update.emit(x, y)
 
     def mouseReleaseEvent(self, event):
-        if self.imageOrigin is None:
+        if not self.has_image:
             return
         if event.button() == Qt.LeftButton:
+            old = QRect(self.selection)
             self.selection.setBottomRight(event.pos())
             self.selection_img = self.to_image_rect(self.selection)
             self.endMouse = True
-            self.selection_update.emit()
-        self.update()
+            self._emit_selection_update()
+            self._update_selection(old)
 
     @property
     def selected_origin(self) -> QImage:
@@ -276,4 +519,4 @@ class ImageWidget(QWidget):
             return img
         else:
             coef = (resolution / need) ** 0.5
-            return img.scaled(img.width() / coef, img.height() / coef)
+            return img.scaled(int(img.width() / coef), int(img.height() / coef))
@@ -0,0 +1,71 @@
+"""
+Opening images: a screen-sized preview right away, full resolution later.
+
+JPEG readers scale in the DCT domain when asked for a smaller size, so the
+preview costs a fraction of a full decode; other formats are decoded once,
+at full size.  The full-resolution image is decoded (or mapped from
+`ImageCache`) in a background thread and handed out as a future.
+"""
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImage, QImageIOHandler, QImageReader
+
+from .cache import ImageCache
+
+# readers that scale while decoding; Qt's PNG reader also takes a scaled
+# size, but it decodes the full image and scales it afterwards
+_SCALED_DECODE = {b"jpeg"}
+
+
+def _scales_on_decode(reader: QImageReader) -> bool:
+    return bytes(reader.format()) in _SCALED_DECODE and reader.supportsOption(QImageIOHandler.ScaledSize)
+
+
+def read_preview(fname: str, size: QSize) -> Tuple[QImage, QSize]:
+    """
+    (preview, full size).  Formats whose reader cannot scale while decoding
+    (PNG, BMP...) are read at full size: scaling them would take the full
+    decode anyway, and a second one would follow for the full image.
+    """
+    reader = QImageReader(fname)
+    full = reader.size()
+
+    if full.isValid() and size.isValid() and _scales_on_decode(reader):
+        scale = min(size.width() / full.width(), size.height() / full.height(), 1)
+        reader.setScaledSize(QSize(max(round(full.width() * scale), 1),
+                                   max(round(full.height() * scale), 1)))
+
+    return reader.read(), full
+
+
+class ImageLoader:
+    def __init__(self, cache: ImageCache):
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def open(self, fname: str, size: QSize) -> Tuple[QImage, QSize, Optional[Future]]:
+        """
+        Returns (image, full size, future of the full image).  The future is
+        None when `image` already is the full image (cached, or unreadable).
+        """
+        if not os.path.isfile(fname):
+            return QImage(fname), QSize(), None
+
+        key = self.cache.key(fname)
+        image = self.cache.load(key)
+        if image is not None:
+            return image, image.size(), None
+
+        preview, full = read_preview(fname, size)
+        if preview.isNull():
+            return preview, full, None
+
+        if preview.size() == full:
+            # nothing was saved by scaling, this is the full image already
+            self.cache.store(key, preview)
+            return preview, full, None
+
+        return preview, full, self._executor.submit(self.cache.open, fname, key)
@@ -0,0 +1,193 @@
+"""
+Memory bookkeeping of the processing pipeline.
+
+`pool` keeps arrays that were given back so the next run with the same
+shape and dtype reuses them instead of allocating.  `accountant` knows how
+many bytes every pipeline stage holds and, when the total goes over its
+budget, asks the registered caches to drop themselves (largest first).
+
+>>> pool = BufferPool(2 ** 20)
+>>> a = pool.take((10, 10), np.uint8)
+>>> pool.give(a)
+>>> pool.take((10, 10), np.uint8) is a
+True
+"""
+import threading
+import weakref
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+DEFAULT_POOL_SIZE = 256 * 2 ** 20
+DEFAULT_BUDGET = 2 * 2 ** 30
+
+
+def parse_size(text: str) -> int:
+    """
+    >>> parse_size("512M"), parse_size("2G"), parse_size("4096")
+    (536870912, 2147483648, 4096)
+    """
+    units = {"K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def nbytes(obj) -> int:
+    if obj is None:
+        return 0
+    if isinstance(obj, QImage):
+        return obj.bytesPerLine() * obj.height()
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if hasattr(obj, "nbytes"):
+        return obj.nbytes
+    return sum(nbytes(item) for item in obj)
+
+
+def _identity(obj):
+    # shallow QImage copies share their pixels, count them once
+    if isinstance(obj, QImage):
+        return "image", obj.cacheKey() >> 32
+    return "object", id(obj)
+
+
+class BufferPool:
+    def __init__(self, max_bytes: int = DEFAULT_POOL_SIZE):
+        self.max_bytes = max_bytes
+        self._free = defaultdict(list)
+        self._order = []
+        self.free_bytes = 0
+        self.reused = 0
+        self.allocated = 0
+        self._lock = threading.Lock()
+
+    def take(self, shape, dtype) -> np.ndarray:
+        """
+        An array of `shape` and `dtype` with arbitrary content.
+        """
+        key = tuple(shape), np.dtype(dtype)
+        with self._lock:
+            if self._free[key]:
+                array = self._free[key].pop()
+                self._order.remove(id(array))
+                self.free_bytes -= array.nbytes
+                self.reused += 1
+                return array
+
+            self.allocated += 1
+        return np.empty(shape, dtype)
+
+    def give(self, array: np.ndarray):
+        if array.base is not None or array.nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            self._free[array.shape, array.dtype].append(array)
+            self._order.append(id(array))
+            self.free_bytes += array.nbytes
+
+            while self.free_bytes > self.max_bytes:
+                self._drop(self._order[0])
+
+    def _drop(self, array_id):
+        for arrays in self._free.values():
+            for i, array in enumerate(arrays):
+                if id(array) == array_id:
+                    del arrays[i]
+                    self._order.remove(array_id)
+                    self.free_bytes -= array.nbytes
+                    return
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+            self._order.clear()
+            self.free_bytes = 0
+
+
+def _callback(fn):
+    # a getter of `fn`, None once the object of a bound method is gone
+    if hasattr(fn, "__self__") and hasattr(fn, "__func__"):
+        return weakref.WeakMethod(fn)
+    return lambda: fn
+
+
+class MemoryAccountant:
+    def __init__(self, budget: int = DEFAULT_BUDGET):
+        self.budget = budget
+        self._stages = OrderedDict()
+        self._caches = OrderedDict()
+
+    def track(self, stage: str, *objects):
+        """
+        Remembers what `stage` holds now (replacing what it held before) and
+        drops caches if the pipeline went over the budget.  Objects are
+        weakly referenced, whatever the stage frees is not counted anymore.
+        """
+        self._stages[stage] = [weakref.ref(obj) for obj in objects if obj is not None]
+        self.enforce()
+
+    def register_cache(self, name: str, size, evict):
+        """
+        `size()` gives the bytes the cache holds, `evict()` frees what it can
+        (a cache may keep what is in use).  Bound
+        methods are weakly referenced: the cache is forgotten once its owner
+        is collected.  Whoever fills a cache calls `enforce()` after it grew.
+        """
+        self._caches[name] = _callback(size), _callback(evict)
+
+    def _live_caches(self):
+        live = []
+        for name, (size, evict) in list(self._caches.items()):
+            size, evict = size(), evict()
+            if size is None or evict is None:
+                del self._caches[name]
+            else:
+                live.append((name, size, evict))
+        return live
+
+    def stages(self) -> "OrderedDict[str, int]":
+        seen = set()
+        result = OrderedDict()
+        for stage, objects in self._stages.items():
+            result[stage] = 0
+            for ref in objects:
+                obj = ref()
+                if obj is None:
+                    continue
+                identity = _identity(obj)
+                if identity not in seen:
+                    seen.add(identity)
+                    result[stage] += nbytes(obj)
+
+        for name, size, _ in self._live_caches():
+            result[name] = size()
+        return result
+
+    def total(self) -> int:
+        return sum(self.stages().values())
+
+    def enforce(self):
+        total = self.total()
+        caches = sorted(self._live_caches(), key=lambda item: -item[1]())
+        for name, size, evict in caches:
+            if total <= self.budget:
+                break
+            # a cache may keep what is in use, only what it freed counts
+            before = size()
+            evict()
+            total -= before - size()
+
+    def report(self) -> str:
+        return " | ".join(
+            "{}: {:.1f}M".format(stage, size / 2 ** 20)
+            for stage, size in self.stages().items() if size
+        ) + " | total {:.1f}M of {:.0f}M".format(self.total() / 2 ** 20, self.budget / 2 ** 20)
+
+
+pool = BufferPool()
+accountant = MemoryAccountant()
+accountant.register_cache("pool", lambda: pool.free_bytes, pool.clear)
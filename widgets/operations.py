@@ -0,0 +1,78 @@
+"""
+Processing chains over RGBA ndarrays, independent from QImage.
+
+A chain is a list of tuples ``(name, *args)``, e.g.
+``[("hsv", 30, 0, 0), ("median", 5)]``.
+
+>>> parse_chain(["hsv:30,0,-10", "sobel", "gaussian:1.5"])
+[('hsv', 30.0, 0.0, -10.0), ('sobel',), ('gaussian', 1.5)]
+>>> chain_halo([("hsv", 30, 0, 0), ("gaussian", 1.5), ("sobel",)])
+7
+>>> is_local([("hsv", 30, 0, 0), ("quantize", 8)])
+False
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+from .gabor import _gabor_rgb, gabor_kernel
+from .memory import pool
+from .processing import _shift_hsv, _gaussian, _sobel, _median, _bilateral, _bilateral_radius
+from .quantize import _quantize
+
+
+def _gaussian_halo(sigma):
+    return int(4 * sigma + 0.5)
+
+
+def _bilateral_halo(sigma_s, sigma_r=25):
+    return _bilateral_radius(sigma_s)
+
+
+def _gabor_halo(theta):
+    return max(gabor_kernel(1, theta=theta).shape) // 2
+
+
+# name: (function over RGBA ndarray, rows of context the function needs)
+OPERATIONS = {
+    "hsv": (_shift_hsv, lambda dh, ds, dv: 0),
+    "gaussian": (_gaussian, _gaussian_halo),
+    "sobel": (_sobel, lambda: 1),
+    "median": (_median, lambda radius: int(radius)),
+    "bilateral": (_bilateral, _bilateral_halo),
+    "gabor": (_gabor_rgb, _gabor_halo),
+    "quantize": (_quantize, lambda k: 0),
+}
+
+# operations whose result depends on the whole image, they can't run on tiles
+GLOBAL_OPERATIONS = {"quantize"}
+
+
+def parse_chain(specs: List[str]) -> List[Tuple]:
+    chain = []
+    for spec in specs:
+        name, _, args = spec.partition(":")
+        if name not in OPERATIONS:
+            raise ValueError("Unknown operation `{}`, may be one of {}".format(
+                name, ", ".join(OPERATIONS)
+            ))
+        chain.append((name, *(float(arg) for arg in args.split(",") if arg)))
+    return chain
+
+
+def chain_halo(chain) -> int:
+    return sum(OPERATIONS[name][1](*args) for name, *args in chain)
+
+
+def is_local(chain) -> bool:
+    return not any(name in GLOBAL_OPERATIONS for name, *args in chain)
+
+
+def apply_chain(rgb: np.ndarray, chain) -> np.ndarray:
+    result = rgb
+    for name, *args in chain:
+        filtered = OPERATIONS[name][0](result, *args)
+        if result is not rgb:
+            pool.give(result)
+        result = filtered
+    return result
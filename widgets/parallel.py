@@ -0,0 +1,192 @@
+"""
+Processing chains in a pool of processes over shared memory.
+
+HSV conversion, kernel construction and the legacy per-pixel code hold the
+GIL, so threads do not scale over them.  `ProcessBackend` copies the image
+into a `multiprocessing.shared_memory` segment once, workers attach to it by
+name (attachments are kept between calls), process their row tiles with
+enough halo rows for the chain and write the rows they own straight into a
+shared output.  Only the chain, tile bounds and segment names are pickled;
+workers answer with the bounds of the tile they finished.
+
+The output is copied out of the backend's segment into a pool array, unless
+the caller hands a `SharedArray` of `output_layout` to write into:
+
+>>> backend = ProcessBackend(4)                          # doctest: +SKIP
+>>> backend.apply(rgb, [("hsv", 30, 0, 0)])              # doctest: +SKIP
+>>> out = SharedArray(*backend.output_layout(rgb, chain))  # doctest: +SKIP
+>>> backend.apply(rgb, chain, out)                       # doctest: +SKIP
+"""
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+import numpy as np
+
+from .memory import pool
+from .operations import apply_chain, chain_halo, is_local
+from .shm import attach
+
+# segments a worker keeps attached, a few frames of different sizes
+_MAX_ATTACHED = 8
+
+_attached = OrderedDict()
+
+
+def _shared_view(name: str, shape, dtype) -> np.ndarray:
+    if name not in _attached:
+        _attached[name] = attach(name)
+        while len(_attached) > _MAX_ATTACHED:
+            _attached.popitem(last=False)[1].close()
+    _attached.move_to_end(name)
+    return np.ndarray(shape, dtype, buffer=_attached[name].buf)
+
+
+def _process_tile(src, dst, chain, top: int, bottom: int, halo: int) -> Tuple[int, int]:
+    source = _shared_view(*src)
+    out = _shared_view(*dst)
+
+    start, stop = max(top - halo, 0), min(bottom + halo, source.shape[0])
+    tile = apply_chain(source[start:stop], chain)
+    out[top:bottom] = tile[top - start:bottom - start]
+    pool.give(tile)
+    return top, bottom
+
+
+def _ready(_):
+    return os.getpid()
+
+
+class SharedArray:
+    """
+    An ndarray in a shared memory segment owned by this process.
+    """
+    def __init__(self, shape, dtype):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self.array = np.ndarray(self.shape, self.dtype, buffer=self._shm.buf)
+
+    @property
+    def spec(self):
+        return self._shm.name, self.shape, self.dtype.str
+
+    def close(self):
+        self.array = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+def _context():
+    # forking a process that runs Qt threads is unsafe, workers start clean
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    if "forkserver" in methods:
+        context.set_forkserver_preload(["widgets.operations", "scipy.ndimage", "scipy.signal"])
+    return context
+
+
+class ProcessBackend:
+    def __init__(self, processes: int = None, tiles: int = None):
+        self.processes = processes or os.cpu_count()
+        self.tiles = tiles or self.processes
+        self._executor = ProcessPoolExecutor(self.processes, mp_context=_context())
+        self._free = []
+        # (operation names, channels, dtype) -> (channels, dtype) of the output
+        self._layouts = {}
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        """
+        Starts every worker now instead of on the first frame.
+        """
+        list(self._executor.map(_ready, range(self.processes)))
+
+    def output_layout(self, rgb: np.ndarray, chain):
+        """
+        (shape, dtype) of `rgb` processed by `chain`.
+        """
+        # grey may come out as RGB, a one pixel run tells the output layout;
+        # it depends on the operations, not on their arguments
+        key = tuple(name for name, *args in chain), rgb.shape[2:], rgb.dtype.str
+        with self._lock:
+            layout = self._layouts.get(key)
+        if layout is None:
+            probe = apply_chain(np.array(rgb[:1, :1]), chain) if chain else rgb[:1, :1]
+            layout = probe.shape[2:], probe.dtype
+            with self._lock:
+                self._layouts[key] = layout
+        return rgb.shape[:2] + layout[0], layout[1]
+
+    def _take(self, layout) -> SharedArray:
+        # segments of the calls in flight, reused while frames keep their size
+        with self._lock:
+            for i, segment in enumerate(self._free):
+                if (segment.shape, segment.dtype) == layout:
+                    return self._free.pop(i)
+        return SharedArray(*layout)
+
+    def _give(self, *segments):
+        with self._lock:
+            self._free.extend(segments)
+            while len(self._free) > 2 * self.processes:
+                self._free.pop(0).close()
+
+    def _tile_bounds(self, height: int, halo: int) -> List[Tuple[int, int]]:
+        # tiles thinner than their halo recompute more than they own
+        rows = max(-(-height // self.tiles), halo, 1)
+        return [(top, min(top + rows, height)) for top in range(0, height, rows)]
+
+    def apply(self, rgb: np.ndarray, chain, out: SharedArray = None) -> np.ndarray:
+        """
+        `rgb` processed by `chain`, written into `out` and returned as
+        ``out.array`` when it is given.
+        """
+        dst_layout = self.output_layout(rgb, chain)
+        if out is not None and (out.shape, out.dtype) != dst_layout:
+            raise ValueError("Output of {} {} expected, got {} {}".format(
+                dst_layout[0], dst_layout[1], out.shape, out.dtype
+            ))
+        if not chain:
+            if out is None:
+                return rgb
+            out.array[...] = rgb
+            return out.array
+
+        src = self._take((rgb.shape, rgb.dtype))
+        dst = out if out is not None else self._take(dst_layout)
+        try:
+            src.array[...] = rgb
+            height = rgb.shape[0]
+            if is_local(chain):
+                halo = chain_halo(chain)
+                tiles = self._tile_bounds(height, halo)
+            else:
+                # the whole image in one worker, still off the caller's GIL
+                halo, tiles = 0, [(0, height)]
+            futures = [
+                self._executor.submit(_process_tile, src.spec, dst.spec, chain, top, bottom, halo)
+                for top, bottom in tiles
+            ]
+            for future in futures:
+                future.result()
+
+            if out is not None:
+                return out.array
+            result = pool.take(*dst_layout)
+            result[...] = dst.array
+            return result
+        finally:
+            self._give(src, *([dst] if out is None else []))
+
+    def close(self):
+        self._executor.shutdown()
+        with self._lock:
+            for segment in self._free:
+                segment.close()
+            self._free.clear()
@@ -1,7 +1,8 @@
+import threading
+from typing import Tuple
+
 import numpy as np
-import scipy
-from scipy.ndimage import gaussian_filter
-from scipy.signal import convolve2d
+
 from numpy import ndarray
 from PyQt5 import QtGui
 from PyQt5.QtGui import QImage
@@ -9,18 +10,38 @@ from PyQt5.QtGui import QImage
 from utils import QColor, hsv_ranged, inrange
 from qimage2ndarray import array2qimage
 
+from .memory import pool
+
+# scipy takes about a second to import, it is imported by the filters that
+# use it (and by `warm_up` once the window is shown)
+_HEAVY_MODULES = ("scipy.ndimage", "scipy.signal", "scipy.fft")
+
+
+def warm_up() -> threading.Thread:
+    """
+    Imports the heavy modules in a background thread, so the first filter
+    does not wait for them.
+    """
+    def run():
+        for name in _HEAVY_MODULES:
+            __import__(name)
+
+    thread = threading.Thread(target=run, name="warm up", daemon=True)
+    thread.start()
+    return thread
 
-def _rgb_to_hsv(rgb: np.ndarray) -> np.ndarray:
+
+def _rgb_to_hsv(rgb: np.ndarray, vmax=255) -> np.ndarray:
     input_shape = rgb.shape
-    rgb = rgb.reshape(-1, 4)
-    r, g, b, a = rgb[:, 0], rgb[:, 1], rgb[:, 2], rgb[:, 3]
+    rgb = rgb.reshape(-1, input_shape[-1])
+    r, g, b, a = rgb[:, 0], rgb[:, 1], rgb[:, 2], rgb[:, 3:]
 
     maxc = np.maximum(np.maximum(r, g), b)
     minc = np.minimum(np.minimum(r, g), b)
     v = maxc
 
     deltac = maxc - minc
-    s = deltac / maxc
+    s = deltac / np.maximum(maxc, 1)  # black has no saturation (and no 0 / 0)
     deltac[deltac == 0] = 1  # to not divide by zero (those results in any way would be overridden in next lines)
     rc = (maxc - r) / deltac
     gc = (maxc - g) / deltac
@@ -34,32 +55,53 @@ def _rgb_to_hsv(rgb: np.ndarray) -> np.ndarray:
     h = (h / 6.0) % 1.0
     h *= 360
     s *= 100
-    v = v * (100 / 255)
+    v = v * (100 / vmax)
 
-    res = np.dstack([h, s, v, a])
+    res = np.column_stack([h, s, v, a])
     return res.reshape(input_shape)
 
 
-def _hsv_to_rgb(hsv: np.ndarray) -> np.ndarray:
+def _rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """
+    Same as `utils.QColor.lab` (sRGB, D65, 2 degrees observer) for a whole
+    array, the last axis is RGB (alpha, if any, is dropped).
+    """
+    rgb = rgb[..., :3] / np.float32(255)
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92) * 100
+
+    xyz = linear @ np.array([
+        [0.4124 / 95.047, 0.2126 / 100.0, 0.0193 / 108.883],
+        [0.3576 / 95.047, 0.7152 / 100.0, 0.1192 / 108.883],
+        [0.1805 / 95.047, 0.0722 / 100.0, 0.9505 / 108.883],
+    ], dtype=np.float32)
+    xyz = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    x, y, z = xyz[..., 0], xyz[..., 1], xyz[..., 2]
+
+    return np.stack([116 * y - 16, 500 * (x - y), 200 * (y - z)], axis=-1)
+
+
+def _hsv_to_rgb(hsv: np.ndarray, vmax=255) -> np.ndarray:
     """
     >>> from colorsys import hsv_to_rgb as hsv_to_rgb_single
     >>> 'r={:.0f} g={:.0f} b={:.0f}'.format(*hsv_to_rgb_single(0.60, 0.79, 239))
     'r=50 g=126 b=239'
     >>> 'r={:.0f} g={:.0f} b={:.0f}'.format(*hsv_to_rgb_single(0.25, 0.35, 200.0))
     'r=165 g=200 b=130'
+    >>> options = np.get_printoptions()
     >>> np.set_printoptions(0)
-    >>> _hsv_to_rgb(np.array([[[0.60, 0.79, 239], [0.25, 0.35, 200.0]]]))
-    array([[[  50.,  126.,  239.],
-            [ 165.,  200.,  130.]]])
+    >>> _hsv_to_rgb(np.array([[[216, 79, 93.7], [90, 35, 78.4]]]))
+    array([[[ 50., 126., 239.],
+            [165., 200., 130.]]])
     >>> 'r={:.0f} g={:.0f} b={:.0f}'.format(*hsv_to_rgb_single(0.60, 0.0, 239))
     'r=239 g=239 b=239'
-    >>> _hsv_to_rgb(np.array([[0.60, 0.79, 239], [0.60, 0.0, 239]]))
-    array([[  50.,  126.,  239.],
-           [ 239.,  239.,  239.]])
+    >>> _hsv_to_rgb(np.array([[216, 79, 93.7], [216, 0, 93.7]]))
+    array([[ 50., 126., 239.],
+           [239., 239., 239.]])
+    >>> np.set_printoptions(**options)
     """
     input_shape = hsv.shape
-    hsv = hsv.reshape(-1, 4)
-    h, s, v, a = hsv[:, 0], hsv[:, 1], hsv[:, 2], hsv[:, 3]
+    hsv = hsv.reshape(-1, input_shape[-1])
+    h, s, v, a = hsv[:, 0], hsv[:, 1], hsv[:, 2], hsv[:, 3:]
 
     i = np.int32((h / 60) % 6)
     _t = (h % 60.) / 60.
@@ -74,7 +116,7 @@ def _hsv_to_rgb(hsv: np.ndarray) -> np.ndarray:
     a: np.ndarray = a
 
     rgb = np.zeros_like(hsv)
-    v, v_inc, v_min, v_dec, a = v.reshape(-1, 1), v_inc.reshape(-1, 1), v_min.reshape(-1, 1), v_dec.reshape(-1, 1), a.reshape(-1, 1)
+    v, v_inc, v_min, v_dec = v.reshape(-1, 1), v_inc.reshape(-1, 1), v_min.reshape(-1, 1), v_dec.reshape(-1, 1)
     rgb[i == 0] = np.hstack([v, v_inc, v_min, a])[i == 0]
     rgb[i == 1] = np.hstack([v_dec, v, v_min, a])[i == 1]
     rgb[i == 2] = np.hstack([v_min, v, v_inc, a])[i == 2]
@@ -83,7 +125,7 @@ def _hsv_to_rgb(hsv: np.ndarray) -> np.ndarray:
     rgb[i == 5] = np.hstack([v, v_min, v_dec, a])[i == 5]
     rgb[s == 0.0] = np.hstack([v, v, v, a])[s == 0.0]
 
-    rgb *= 2.55
+    rgb[:, :3] *= vmax / 100
 
     return rgb.reshape(input_shape)
 
@@ -95,71 +137,217 @@ def getdata(image):
     return (int(image.bits()), False)
 
 
-def qimageview(image: QImage) -> ndarray:
+# format: (channels, dtype, stored as BGRA)
+_FORMATS = {
+    QImage.Format_RGB32: (4, "|u1", True),
+    QImage.Format_ARGB32: (4, "|u1", True),
+    QImage.Format_ARGB32_Premultiplied: (4, "|u1", True),
+    QImage.Format_RGBX8888: (4, "|u1", False),
+    QImage.Format_RGBA8888: (4, "|u1", False),
+    QImage.Format_RGBA8888_Premultiplied: (4, "|u1", False),
+    QImage.Format_RGB888: (3, "|u1", False),
+    QImage.Format_Grayscale8: (1, "|u1", False),
+}
+
+# 16 bit formats appeared in Qt 5.12 / 5.13
+for _name, _spec in [("Format_RGBX64", (4, "<u2", False)),
+                     ("Format_RGBA64", (4, "<u2", False)),
+                     ("Format_RGBA64_Premultiplied", (4, "<u2", False)),
+                     ("Format_Grayscale16", (1, "<u2", False))]:
+    if hasattr(QImage, _name):
+        _FORMATS[getattr(QImage, _name)] = _spec
+
+
+def native(image: QImage) -> QImage:
+    """
+    `image` itself if `qimageview` can read its format, else an ARGB32 copy.
+    """
+    if image.format() in _FORMATS:
+        return image
+    return image.convertToFormat(QImage.Format_ARGB32)
+
+
+def _view(image: QImage, data) -> Tuple[ndarray, bool]:
     if not isinstance(image, QtGui.QImage):
         raise TypeError("image argument must be a QImage instance")
 
-    shape = image.height(), image.width(), 4
-    strides0 = image.bytesPerLine()
-
     format = image.format()
 
-    dtype = "|u1"
-    strides1 = 4
-    strides2 = 1
-
     if format == QtGui.QImage.Format_Invalid:
         raise ValueError("qimageview got invalid QImage")
 
+    if format not in _FORMATS:
+        raise ValueError("qimageview can't read QImage format {}, convert it with `native`".format(format))
+
+    channels, dtype, bgra = _FORMATS[format]
+    itemsize = np.dtype(dtype).itemsize
+
+    if channels == 1:
+        shape = image.height(), image.width()
+        strides = image.bytesPerLine(), itemsize
+    else:
+        shape = image.height(), image.width(), channels
+        strides = image.bytesPerLine(), channels * itemsize, itemsize
+
     image.__array_interface__ = {
         'shape': shape,
         'typestr': dtype,
-        'data': getdata(image),
-        'strides': (strides0, strides1, strides2),
+        'data': data,
+        'strides': strides,
         'version': 3,
     }
 
     result = np.asarray(image)
-    result[..., :3] = result[..., 2::-1]
     del image.__array_interface__
+    return result, bgra
+
+
+def qimageview(image: QImage) -> ndarray:
+    """
+    Writable view of the image pixels: (height, width) for grayscale,
+    (height, width, 3) for RGB888, (height, width, 4) RGBA otherwise.
+    16 bit formats give uint16 arrays.  Blue and red of 32 bit BGRA formats
+    are swapped in place, so the view is always RGB(A) ordered.
+    """
+    result, bgra = _view(image, getdata(image))
+    if bgra:
+        result[..., :3] = result[..., 2::-1]
     return result
 
 
-def shift_hsv(image: QImage, dh, ds, dv):
-    yield 0.0
-    rgb = qimageview(image.copy())
-    yield 0.18
-    hsv = _rgb_to_hsv(rgb)
-    yield 0.36
+def pixels(image: QImage) -> ndarray:
+    """
+    RGB(A) ordered copy of the pixels, like `qimageview` but leaving the
+    image alone.  The array comes from `memory.pool`, give it back there
+    when done.
+    """
+    image = native(image)
+    raw, bgra = _view(image, (int(image.constBits()), True))
+
+    result = pool.take(raw.shape, raw.dtype)
+    if bgra:
+        result[..., :3] = raw[..., 2::-1]
+        result[..., 3] = raw[..., 3]
+    else:
+        result[...] = raw
+    return result
+
+
+def to_qimage(array: np.ndarray) -> QImage:
+    """
+    Inverse of `qimageview`: a new QImage of the format matching the array
+    shape and depth.
+    """
+    if array.dtype == np.uint8 and array.ndim == 3 and array.shape[2] == 4:
+        return array2qimage(array)
+
+    wide = array.dtype == np.uint16
+    if array.ndim == 2:
+        format = QImage.Format_Grayscale16 if wide else QImage.Format_Grayscale8
+    elif array.shape[2] == 3 and not wide:
+        format = QImage.Format_RGB888
+    else:
+        format = QImage.Format_RGBA64 if wide else QImage.Format_RGBA8888
+
+    if wide and array.ndim == 3 and array.shape[2] == 3:
+        alpha = np.full(array.shape[:2] + (1,), 0xffff, dtype=np.uint16)
+        array = np.concatenate([array, alpha], axis=2)
+
+    image = QImage(array.shape[1], array.shape[0], format)
+    qimageview(image)[...] = array
+    return image
+
+
+def array_image(array: np.ndarray, format=QImage.Format_RGBA8888) -> QImage:
+    # zero-copy: the QImage borrows `array`'s memory and keeps a reference
+    array = np.require(array, np.uint8, "C")
+    height, width = array.shape[:2]
+    image = QImage(array.ctypes.data, width, height, array.strides[0], format)
+    image._array = array
+    return image
+
+
+def _depth_max(array: np.ndarray):
+    return np.iinfo(array.dtype).max if array.dtype.kind in "ui" else 255
+
+
+def _shift_hsv(rgb: np.ndarray, dh, ds, dv) -> np.ndarray:
+    vmax = _depth_max(rgb)
+
+    if rgb.ndim == 2:
+        if ds <= 0:
+            # grey stays grey, only its value moves
+            v = np.clip(rgb * (100 / vmax) + dv, 0, 100)
+            return (v * (vmax / 100) + 0.5).astype(rgb.dtype)
+        rgb = np.dstack([rgb, rgb, rgb])
+
+    hsv = _rgb_to_hsv(rgb, vmax)
     hsv[..., 0] += dh
     hsv[..., 0] %= 360
-    yield 0.54
     hsv[..., 1] += ds
     np.clip(hsv[..., 1], 0, 100, out=hsv[..., 1])
-    yield 0.72
     hsv[..., 2] += dv
     np.clip(hsv[..., 2], 0, 100, out=hsv[..., 2])
-    yield 0.9
+    return np.clip(_hsv_to_rgb(hsv, vmax), 0, vmax).astype(rgb.dtype)
+
+
+def _filter_planes(rgb: np.ndarray, plane_filter, *args) -> np.ndarray:
+    # single channel images are filtered as one plane, alpha is kept as is
+    filtered = pool.take(rgb.shape, rgb.dtype)
+
+    if rgb.ndim == 2:
+        filtered[...] = plane_filter(rgb, *args)
+        return filtered
+
+    filtered[..., 0] = plane_filter(rgb[..., 0], *args)
+    filtered[..., 1] = plane_filter(rgb[..., 1], *args)
+    filtered[..., 2] = plane_filter(rgb[..., 2], *args)
+    filtered[..., 3:] = rgb[..., 3:]
+    return filtered
+
 
-    new_img = _hsv_to_rgb(hsv)
+def _filter_channels(rgb: np.ndarray, channels_filter, *args) -> np.ndarray:
+    # as `_filter_planes`, but the colour planes are filtered together, as
+    # one (height, width, channels) array
+    filtered = pool.take(rgb.shape, rgb.dtype)
+
+    if rgb.ndim == 2:
+        filtered[...] = channels_filter(rgb[..., None], *args)[..., 0]
+        return filtered
+
+    filtered[..., :3] = channels_filter(rgb[..., :3], *args)
+    filtered[..., 3:] = rgb[..., 3:]
+    return filtered
+
+
+def _apply(image: QImage, function, *args) -> QImage:
+    rgb = pixels(image)
+    filtered = function(rgb, *args)
+
+    img: QImage = to_qimage(filtered)
+    pool.give(rgb)
+    pool.give(filtered)
+    return img
+
+
+def shift_hsv(image: QImage, dh, ds, dv):
+    yield 0.0
+    rgb = pixels(image)
+    yield 0.18
+    new_img = _shift_hsv(rgb, dh, ds, dv)
+    pool.give(rgb)
     yield 1
-    img: QImage = array2qimage(new_img)
+    img: QImage = to_qimage(new_img)
     yield img
 
 
-def gaussian(image: QImage, sigma: int) -> QImage:
-    rgb = qimageview(image.copy())
+def _gaussian(rgb: np.ndarray, sigma) -> np.ndarray:
+    from scipy.ndimage import gaussian_filter
+    return _filter_planes(rgb, gaussian_filter, sigma)
 
-    filtered = np.zeros_like(rgb)
-    # red = rgb[..., 0]
-    filtered[..., 0] = gaussian_filter(rgb[..., 0], sigma)
-    filtered[..., 1] = gaussian_filter(rgb[..., 1], sigma)
-    filtered[..., 2] = gaussian_filter(rgb[..., 2], sigma)
-    # scipy.signal.convolve2d
-    filtered[..., 3] = rgb[..., 3]
 
-    img: QImage = array2qimage(filtered)
-    return img
+def gaussian(image: QImage, sigma: int) -> QImage:
+    return _apply(image, _gaussian, sigma)
 
 
 _sobel_x = np.array([[-1, -2, -1], [0, 0, 0], [1, 2, 1]])
@@ -167,22 +355,226 @@ _sobel_y = np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]])
 
 
 def _sobel_one_axis(part):
+    from scipy.signal import convolve2d
     return (convolve2d(part, _sobel_y, mode="same") ** 2
             + convolve2d(part, _sobel_x, mode="same") ** 2) ** 0.5
 
 
+def _sobel(rgb: np.ndarray) -> np.ndarray:
+    return _filter_planes(rgb, _sobel_one_axis)
+
+
 def sobel(image: QImage) -> QImage:
-    rgb = qimageview(image.copy())
+    return _apply(image, _sobel)
+
+
+# elements of the fine column histograms a block of rows may take
+_MEDIAN_BLOCK = 1 << 23
+
+
+def _median_channels(planes: np.ndarray, radius: int) -> np.ndarray:
+    # Perreault-Hebert: one histogram per column over the window's rows, the
+    # kernel histogram slides along a row adding the column that enters and
+    # removing the one that leaves, so the cost does not depend on radius.
+    # Numpy steps many kernels at once: all the channels, a block of rows and
+    # the segments a row is cut into.  Coarse histograms (cumulative, 16 bins)
+    # find the median's high nibble, fine ones (256 bins) - the low one.
+    height, width, count = planes.shape
+    size = 2 * radius + 1
+    half = size * size // 2
+    # counts never exceed size ** 2, so wrapping uint16 sums stay exact, a
+    # column holds at most size values
+    dtype = np.uint16 if size * size < 2 ** 16 else np.uint32
+    column_dtype = np.uint8 if size < 2 ** 8 else dtype
+
+    length = min(width, max(64, 4 * size))
+    segments = -(-width // length)
+    span = segments * length + size - 1
+    rows = max(1, min(16, height, _MEDIAN_BLOCK // (span * count * 256)))
+    padded = np.pad(planes, ((radius, radius), (radius, span - width - radius), (0, 0)), mode="edge")
+
+    # column histograms over the current window rows, (span, count, 256) fine
+    # and (16, span, count) coarse ones
+    fine_hist = np.zeros((span, count, 256), column_dtype)
+    coarse_hist = np.zeros((16, span, count), dtype)
+    fine, coarse = fine_hist.reshape(-1), coarse_hist.reshape(-1)
+    column = np.arange(span * count).reshape(span, count)
+    fine_at = column * 256 + padded
+    coarse_at = (padded >> 4).astype(np.intp) * (span * count) + column
+
+    def add_row(y):
+        fine[fine_at[y]] += 1
+        coarse[coarse_at[y]] += 1
+
+    def remove_row(y):
+        fine[fine_at[y]] -= 1
+        coarse[coarse_at[y]] -= 1
+
+    for y in range(size - 1):
+        add_row(y)
+
+    # column histograms of a block of rows, the coarse ones are cumulative:
+    # how many values are below each high nibble, summed along the row too
+    fine_cols = np.empty((rows, span, count, 256), column_dtype)
+    coarse_cols = np.zeros((rows, 17, span + 1, count), dtype)
+    stretch = segments * length
+    result = np.empty_like(planes)
+    for top in range(0, height, rows):
+        n = min(rows, height - top)
+        for j in range(n):
+            add_row(top + j + size - 1)
+            fine_cols[j] = fine_hist
+            coarse_cols[j, 1:, 1:] = coarse_hist
+            remove_row(top + j)
+
+        sums = coarse_cols[:n]
+        for k in range(2, 17):
+            sums[:, k] += sums[:, k - 1]
+        np.cumsum(sums, axis=2, out=sums)
+        below = sums[:, :, size:size + stretch] - sums[:, :, :stretch]
+        group = (below[:, 1:] <= half).sum(axis=1)
+        skipped = np.take_along_axis(below, group[:, None], 1)[:, 0]
+
+        # kernels of (row, segment, channel) lanes slide along the segments
+        lanes = np.arange(n * segments * count)
+        steps = group.reshape(n, segments, length, count).transpose(2, 0, 1, 3).reshape(length, -1)
+        at = steps * 16 + lanes * 256 + np.arange(16)[:, None, None]
+        kernel = np.zeros((n, segments, count, 256), dtype)
+        for x in range(size - 1):
+            kernel += fine_cols[:n, x:x + stretch:length]
+
+        low = np.empty((16, length, lanes.size), dtype)
+        for x in range(length):
+            kernel += fine_cols[:n, x + size - 1:x + size - 1 + stretch:length]
+            kernel.take(at[:, x], out=low[:, x])
+            kernel -= fine_cols[:n, x:x + stretch:length]
+
+        for k in range(1, 16):
+            low[k] += low[k - 1]
+        skipped = skipped.reshape(n, segments, length, count).transpose(2, 0, 1, 3).reshape(length, -1)
+        low = (low <= half - skipped).sum(axis=0).reshape(length, n, segments, count)
+        median = group * 16 + low.transpose(1, 2, 0, 3).reshape(n, stretch, count)
+        result[top:top + n] = median[:, :width]
 
-    filtered = np.zeros_like(rgb)
+    return result
 
-    filtered[..., 0] = _sobel_one_axis(rgb[..., 0])
-    filtered[..., 1] = _sobel_one_axis(rgb[..., 1])
-    filtered[..., 2] = _sobel_one_axis(rgb[..., 2])
-    filtered[..., 3] = rgb[..., 3]
 
-    img: QImage = array2qimage(filtered)
-    return img
+def _small_median_plane(plane: np.ndarray, radius: int) -> np.ndarray:
+    from scipy.ndimage import median_filter
+    return median_filter(plane, size=2 * radius + 1, mode="nearest")
+
+
+def _median(rgb: np.ndarray, radius: int) -> np.ndarray:
+    radius = int(radius)
+
+    if radius < 1:
+        return rgb.copy()
+
+    # a direct sort of a tiny window is still cheaper than histograms,
+    # 16 bit planes would need 65536 bins per column
+    if radius <= 2 or rgb.dtype != np.uint8:
+        return _filter_planes(rgb, _small_median_plane, radius)
+    return _filter_channels(rgb, _median_channels, radius)
+
+
+def median(image: QImage, radius: int) -> QImage:
+    return _apply(image, _median, radius)
+
+
+def _bilateral_radius(sigma_s) -> int:
+    # pixels a result depends on, either way the plane is filtered
+    return int(3 * sigma_s) if _bilateral_direct(sigma_s) else int(np.ceil(4 * sigma_s))
+
+
+def _bilateral_direct(sigma_s) -> bool:
+    # a grid finer than a couple of pixels is bigger than the plane, the
+    # window of a small sigma is cheaper summed directly
+    return int(3 * sigma_s) <= 4
+
+
+def _bilateral_window(plane: np.ndarray, sigma_s, sigma_r) -> np.ndarray:
+    # the definition: weights of the 3 sigma window, range ones from a LUT
+    hi = _depth_max(plane)
+    radius = int(3 * sigma_s)
+    height, width = plane.shape
+    padded = np.pad(plane, radius, mode="edge").astype(np.int32)
+    centre = padded[radius:radius + height, radius:radius + width]
+    closeness = np.exp(-np.arange(-hi, hi + 1, dtype=np.float32) ** 2 / (2 * sigma_r ** 2))
+
+    num = np.zeros(plane.shape, np.float32)
+    den = np.zeros(plane.shape, np.float32)
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            near = padded[radius + dy:radius + dy + height, radius + dx:radius + dx + width]
+            weight = closeness.take(near - centre + hi)
+            weight *= np.float32(np.exp(-(dx * dx + dy * dy) / (2 * sigma_s ** 2)))
+            num += weight * near
+            den += weight
+    return num / den
+
+
+def _bilateral_grid(plane: np.ndarray, sigma_s, sigma_r) -> np.ndarray:
+    # Paris-Durand bilateral grid: pixels are splatted into a (y, x, value)
+    # grid sampled every sigma_s pixels and sigma_r levels (bilinearly in
+    # space, to the nearest level), the grid is blurred with a gaussian of
+    # one cell and read back at each pixel with trilinear interpolation.
+    # The grid is laid from the plane's corner, so a strip of an image is
+    # filtered a little differently than inside the whole one.
+    from scipy.ndimage import gaussian_filter
+
+    hi = _depth_max(plane)
+    height, width = plane.shape
+    shape = (int((height - 1) / sigma_s) + 2, int((width - 1) / sigma_s) + 2, int(hi / sigma_r) + 2)
+    y = np.arange(height, dtype=np.float32) / np.float32(sigma_s)
+    x = np.arange(width, dtype=np.float32) / np.float32(sigma_s)
+    z = plane / np.float32(sigma_r)
+    iy, ix, iz = y.astype(np.intp), x.astype(np.intp), z.astype(np.intp)
+    wy, wx, wz = (y - iy)[:, None], x - ix, (z - iz).ravel()
+    cell = ((iy[:, None] * shape[1] + ix) * shape[2] + iz).ravel()
+    corners = [
+        (0, (1 - wy) * (1 - wx)), (shape[2], (1 - wy) * wx),
+        (shape[1] * shape[2], wy * (1 - wx)), ((shape[1] + 1) * shape[2], wy * wx),
+    ]
+
+    nearest = cell + (wz >= 0.5)
+    at = np.concatenate([nearest + offset for offset, _ in corners])
+    weight = np.concatenate([weight.ravel() for _, weight in corners])
+    size = shape[0] * shape[1] * shape[2]
+    den = np.bincount(at, weight, size).reshape(shape)
+    num = np.bincount(at, weight * np.tile(plane.ravel(), 4), size).reshape(shape)
+    den = gaussian_filter(den.astype(np.float32), 1, mode="constant", truncate=2).ravel()
+    num = gaussian_filter(num.astype(np.float32), 1, mode="constant", truncate=2).ravel()
+
+    result_num = np.zeros(cell.size, np.float32)
+    result_den = np.zeros(cell.size, np.float32)
+    for offset, weight in corners:
+        weight = weight.ravel()
+        for grid, result in ((num, result_num), (den, result_den)):
+            lower = grid.take(cell + offset)
+            result += weight * (lower + wz * (grid.take(cell + offset + 1) - lower))
+    return (result_num / np.maximum(result_den, 1e-6)).reshape(plane.shape)
+
+
+def _bilateral_plane(plane: np.ndarray, sigma_s, sigma_r) -> np.ndarray:
+    # `sigma_r` is in 8 bit units whatever the depth of the plane is
+    hi = _depth_max(plane)
+    sigma_r = sigma_r * hi / 255
+    if _bilateral_direct(sigma_s):
+        result = _bilateral_window(plane, sigma_s, sigma_r)
+    else:
+        result = _bilateral_grid(plane, sigma_s, sigma_r)
+    return np.clip(result + 0.5, 0, hi).astype(plane.dtype)
+
+
+def _bilateral(rgb: np.ndarray, sigma_s, sigma_r=25) -> np.ndarray:
+    if sigma_s <= 0:
+        return rgb.copy()
+
+    return _filter_planes(rgb, _bilateral_plane, sigma_s, sigma_r)
+
+
+def bilateral(image: QImage, sigma_s, sigma_r=25) -> QImage:
+    return _apply(image, _bilateral, sigma_s, sigma_r)
 
 
 def shift_old_hsv(image: QImage, dh, ds, dv):
@@ -0,0 +1,140 @@
+"""
+Colour quantization: the image in its `k` dominant colours.
+
+Pixels are binned by the top 5 bits of every channel (8 bits of a grey
+plane) into a weighted histogram; only the occupied bins, represented by the
+mean colour of their pixels, are clustered with weighted k-means in Lab (or
+HSV, or RGB).  Every bin then gets the mean colour of its cluster and the
+image is mapped through that table in one gather.  Apart from binning and
+the gather, which are single vectorized passes, time depends on the number
+of distinct colours and not on the pixel count.
+"""
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from .memory import pool
+from .processing import _apply, _depth_max, _rgb_to_hsv, _rgb_to_lab
+
+_COLOUR_BITS = 5
+_GREY_BITS = 8
+
+SPACES = ("Lab", "HSV", "RGB")
+
+
+def _bin_index(rgb: np.ndarray, vmax) -> np.ndarray:
+    shift = int(vmax).bit_length()
+
+    if rgb.ndim == 2:
+        return (rgb >> (shift - _GREY_BITS)).astype(np.uint16)
+
+    shift -= _COLOUR_BITS
+    index = (rgb[..., 0] >> shift).astype(np.uint16)
+    for c in (1, 2):
+        index <<= _COLOUR_BITS
+        index |= (rgb[..., c] >> shift).astype(np.uint16)
+    return index
+
+
+def colour_histogram(rgb: np.ndarray):
+    """
+    (bin index of every pixel, occupied bins, their pixel counts, their mean
+    colours as float rows)
+    """
+    vmax = _depth_max(rgb)
+    index = _bin_index(rgb, vmax)
+    flat = index.ravel()
+    size = 2 ** _GREY_BITS if rgb.ndim == 2 else 2 ** (3 * _COLOUR_BITS)
+
+    counts = np.bincount(flat, minlength=size)
+    bins = np.flatnonzero(counts)
+    weights = counts[bins].astype(np.float64)
+
+    channels = [rgb] if rgb.ndim == 2 else [rgb[..., c] for c in range(3)]
+    colours = np.stack([
+        np.bincount(flat, channel.ravel(), minlength=size)[bins] / weights for channel in channels
+    ], axis=1)
+    return index, bins, weights, colours
+
+
+def _features(colours: np.ndarray, vmax, space: str) -> np.ndarray:
+    if colours.shape[1] == 1 or space == "RGB":
+        return colours * (255 / vmax)
+
+    rgb = colours * (255 / vmax)
+    if space == "Lab":
+        return _rgb_to_lab(rgb.astype(np.float32)).astype(np.float64)
+    if space == "HSV":
+        # hue is an angle, the cone keeps red next to red
+        hsv = _rgb_to_hsv(rgb)
+        angle = np.radians(hsv[:, 0])
+        return np.column_stack([hsv[:, 1] * np.cos(angle), hsv[:, 1] * np.sin(angle), hsv[:, 2]])
+    raise ValueError("Colour space may be one of {}, not `{}`".format(SPACES, space))
+
+
+def weighted_kmeans(points: np.ndarray, weights: np.ndarray, k: int, iterations: int = 50, seed: int = 0):
+    """
+    (label of every point, centers), seeded with weighted k-means++.
+    """
+    rng = np.random.default_rng(seed)
+    k = max(min(int(k), len(points)), 1)
+
+    centers = [points[rng.choice(len(points), p=weights / weights.sum())]]
+    closest = ((points - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        chance = weights * closest
+        if chance.sum() <= 0:
+            break  # fewer distinct colours than clusters
+        center = points[rng.choice(len(points), p=chance / chance.sum())]
+        centers.append(center)
+        np.minimum(closest, ((points - center) ** 2).sum(axis=1), out=closest)
+    centers = np.array(centers)
+
+    squares = (points ** 2).sum(axis=1)[:, None]
+    for _ in range(iterations):
+        distances = squares - 2 * points @ centers.T + (centers ** 2).sum(axis=1)
+        labels = distances.argmin(axis=1)
+
+        total = np.bincount(labels, weights, minlength=len(centers))
+        moved = np.stack([
+            np.bincount(labels, weights * points[:, c], minlength=len(centers))
+            for c in range(points.shape[1])
+        ], axis=1)
+        occupied = total > 0
+        moved[occupied] /= total[occupied, None]
+        moved[~occupied] = centers[~occupied]
+
+        if np.allclose(moved, centers):
+            break
+        centers = moved
+
+    return labels, centers
+
+
+def _quantize(rgb: np.ndarray, k, space: str = "Lab") -> np.ndarray:
+    vmax = _depth_max(rgb)
+    index, bins, weights, colours = colour_histogram(rgb)
+    labels, _ = weighted_kmeans(_features(colours, vmax, space), weights, k)
+    return _paint(rgb, index, bins, weights, colours, labels)
+
+
+def _paint(rgb: np.ndarray, index, bins, weights, colours, labels) -> np.ndarray:
+    # clusters are painted with the mean colour of their pixels
+    total = np.bincount(labels, weights)
+    palette = np.stack([
+        np.bincount(labels, weights * colours[:, c]) for c in range(colours.shape[1])
+    ], axis=1) / np.maximum(total, 1)[:, None]
+
+    lut = np.zeros((2 ** _GREY_BITS if rgb.ndim == 2 else 2 ** (3 * _COLOUR_BITS), colours.shape[1]), rgb.dtype)
+    lut[bins] = np.round(palette[labels]).astype(rgb.dtype)
+
+    result = pool.take(rgb.shape, rgb.dtype)
+    if rgb.ndim == 2:
+        np.take(lut[:, 0], index, out=result)
+    else:
+        result[..., :3] = lut[index]
+        result[..., 3:] = rgb[..., 3:]
+    return result
+
+
+def quantize(image: QImage, k, space: str = "Lab") -> QImage:
+    return _apply(image, _quantize, k, space)
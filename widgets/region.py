@@ -0,0 +1,191 @@
+"""
+RGB / HSV / Lab arrays and statistics of rectangular regions of an image.
+
+Planes of the whole image are computed per colour space on first use, in
+bands of rows; regions are views into them.  The sums of every ``TILE`` x
+``TILE`` tile (of the values and of their squares) are kept as float64
+summed-area tables over the grid of tiles.  Mean and std of a rectangle
+come from the tiles it covers whole, in constant time, plus the strips
+along its edges read from the plane: the cost follows the perimeter of the
+rectangle, not its area, and the tables take 1 / TILE² of the image.  Hue
+is an angle, it is summed as its cosine and sine and its mean and std are
+circular.
+"""
+import threading
+from collections import namedtuple
+from typing import Optional
+
+import numpy as np
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QImage
+
+from .processing import qimageview, _rgb_to_hsv, _rgb_to_lab
+
+RegionStats = namedtuple("RegionStats", "mean std min max")
+
+SPACES = ("RGB", "HSV", "Lab")
+
+TILE = 16
+
+# rows converted or summed at a time, bounds the float64 temporaries
+_BAND_ROWS = 8 * TILE
+
+
+def _moments(values: np.ndarray, space: str) -> np.ndarray:
+    """
+    Columns to sum for the statistics of a (..., 3) array: the channels and
+    their squares, or the cosine and sine of the hue in place of hue and
+    its square.
+    """
+    values = values.reshape(-1, 3).astype(np.float64)
+    squares = values ** 2
+    if space == "HSV":
+        hue = np.radians(values[:, 0])
+        values[:, 0] = np.cos(hue)
+        squares[:, 0] = np.sin(hue)
+    return np.concatenate([values, squares], axis=1)
+
+
+def _mean_std(sums: np.ndarray, count: int, space: str):
+    """
+    >>> sums = _moments(np.array([[350., 50, 50], [30., 50, 50]]), "HSV").sum(axis=0)
+    >>> mean, std = _mean_std(sums, 2, "HSV")
+    >>> mean.round(1).tolist(), std.round(1).tolist()
+    ([10.0, 50.0, 50.0], [20.2, 0.0, 0.0])
+    """
+    mean = sums[:3] / count
+    std = np.sqrt(np.maximum(sums[3:] / count - mean ** 2, 0))
+
+    if space == "HSV":
+        cos, sin = mean[0], sums[3] / count
+        length = min(np.hypot(cos, sin), 1)
+        mean[0] = np.degrees(np.arctan2(sin, cos)) % 360
+        std[0] = np.degrees(np.sqrt(-2 * np.log(max(length, 1e-12))))
+    return mean, std
+
+
+class ColorPlanes:
+    def __init__(self, image: QImage):
+        self._rgba = qimageview(image.convertToFormat(QImage.Format_ARGB32))
+        self._planes = {"RGB": self._rgba[..., :3]}
+        self._tiles = {}
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        planes = sum(plane.nbytes for space, plane in self._planes.items() if space != "RGB")
+        tiles = sum(table.nbytes for table in self._tiles.values())
+        return self._rgba.nbytes + planes + tiles
+
+    @property
+    def width(self):
+        return self._rgba.shape[1]
+
+    @property
+    def height(self):
+        return self._rgba.shape[0]
+
+    def plane(self, space: str) -> np.ndarray:
+        with self._lock:
+            if space not in self._planes:
+                self._planes[space] = self._convert(space)
+            return self._planes[space]
+
+    def _convert(self, space: str) -> np.ndarray:
+        if space == "HSV":
+            convert = lambda rgba: _rgb_to_hsv(rgba)[..., :3]
+        elif space == "Lab":
+            convert = _rgb_to_lab
+        else:
+            raise ValueError("Colour space may be one of {}, not `{}`".format(SPACES, space))
+
+        plane = np.empty(self._rgba.shape[:2] + (3,), np.float32)
+        for top in range(0, self.height, _BAND_ROWS):
+            plane[top:top + _BAND_ROWS] = convert(self._rgba[top:top + _BAND_ROWS])
+        return plane
+
+    def pixel(self, x: int, y: int):
+        # the planes are built whole on first use, a pixel is then an index
+        return self._rgba[y, x, :3], self.plane("HSV")[y, x], self.plane("Lab")[y, x]
+
+    def converted(self, space: str) -> bool:
+        return space in self._planes
+
+    def ready(self, space: str) -> bool:
+        return space in self._tiles
+
+    def prepare(self, space: str):
+        """
+        Builds the plane and tile sums of `space`, safe to call from a worker
+        thread.
+        """
+        plane = self.plane(space)
+        with self._lock:
+            if space in self._tiles:
+                return
+
+            rows, columns = self.height // TILE, self.width // TILE
+            tiles = np.zeros((rows + 1, columns + 1, 6))
+            step = _BAND_ROWS // TILE
+            for row in range(0, rows, step):
+                band = plane[row * TILE:min(row + step, rows) * TILE, :columns * TILE]
+                count = band.shape[0] // TILE
+                tiles[row + 1:row + 1 + count, 1:] = \
+                    _moments(band, space).reshape(count, TILE, columns, TILE, 6).sum(axis=(1, 3))
+            np.cumsum(tiles, axis=0, out=tiles)
+            np.cumsum(tiles, axis=1, out=tiles)
+            self._tiles[space] = tiles
+
+    def clip(self, rect: QRect) -> Optional[QRect]:
+        rect = rect.normalized().intersected(QRect(0, 0, self.width, self.height))
+        return None if rect.isEmpty() else rect
+
+    def region(self, rect: QRect, space: str = "RGB") -> Optional[np.ndarray]:
+        rect = self.clip(rect)
+        if rect is None:
+            return None
+        return self.plane(space)[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1]
+
+    def _sums(self, space: str, top: int, left: int, bottom: int, right: int) -> np.ndarray:
+        self.prepare(space)
+        tiles, plane = self._tiles[space], self._planes[space]
+
+        # tiles inside the rectangle, then the strips around them
+        first_row, first_column = -(-top // TILE), -(-left // TILE)
+        last_row, last_column = bottom // TILE, right // TILE
+        if first_row >= last_row or first_column >= last_column:
+            pieces = [(top, left, bottom, right)]
+            sums = np.zeros(6)
+        else:
+            inner_top, inner_left = first_row * TILE, first_column * TILE
+            inner_bottom, inner_right = last_row * TILE, last_column * TILE
+            pieces = [
+                (top, left, inner_top, right),
+                (inner_bottom, left, bottom, right),
+                (inner_top, left, inner_bottom, inner_left),
+                (inner_top, inner_right, inner_bottom, right),
+            ]
+            sums = (tiles[last_row, last_column] - tiles[first_row, last_column]
+                    - tiles[last_row, first_column] + tiles[first_row, first_column])
+
+        for y0, x0, y1, x1 in pieces:
+            if y0 < y1 and x0 < x1:
+                sums = sums + _moments(plane[y0:y1, x0:x1], space).sum(axis=0)
+        return sums
+
+    def mean_std(self, rect: QRect, space: str = "RGB"):
+        rect = self.clip(rect)
+        if rect is None:
+            return None
+
+        sums = self._sums(space, rect.top(), rect.left(), rect.bottom() + 1, rect.right() + 1)
+        return _mean_std(sums, rect.width() * rect.height(), space)
+
+    def stats(self, rect: QRect, space: str = "RGB") -> Optional[RegionStats]:
+        # min / max have no summed-area form, they scan the region view
+        region = self.region(rect, space)
+        if region is None:
+            return None
+
+        mean, std = self.mean_std(rect, space)
+        return RegionStats(mean, std, region.min(axis=(0, 1)), region.max(axis=(0, 1)))
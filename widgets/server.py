@@ -0,0 +1,314 @@
+"""
+Local processing server for other programs.
+
+Chains of operations (see ``operations.py``) are served over a Unix socket
+as JSON lines; pixels never go through the socket.  A request names the
+input as a shared memory segment or a ``.npy`` file and gets the result back
+the same way:
+
+    {"cmd": "apply", "chain": ["hsv:30,0,0", "median:3"],
+     "input": {"shm": "psm_1234", "shape": [1080, 1920, 4], "dtype": "|u1"},
+     "key": "optional cache key of the input"}
+    -> {"ok": true, "cached": false,
+        "output": {"shm": "psm_5678", "shape": [1080, 1920, 4], "dtype": "|u1"}}
+
+With ``"output": {"npy": path}`` the result is written to that file instead.
+Output segments belong to the server and live in its result cache; clients
+attach and copy them right away, and the segment of a reply is kept until
+the client's next request or until it hangs up.  Identical requests that
+arrive while one is running wait for it instead of running again.  Distinct
+requests are not batched together: each one is already split in row tiles
+over the whole worker pool.  The worker pool is started
+and scipy imported when the server starts, not per call.
+
+    python -m widgets.server --socket /tmp/graphen.sock --processes 4
+
+``client.py`` next to ``main.py`` talks to it with numpy alone.
+"""
+import argparse
+import hashlib
+import json
+import os
+import signal
+import socketserver
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from .memory import parse_size, pool
+from .operations import apply_chain, parse_chain
+from .parallel import ProcessBackend, SharedArray
+from .processing import warm_up
+from .shm import attach
+
+DEFAULT_SOCKET = "/tmp/graphen.sock"
+DEFAULT_CACHE = 512 * 2 ** 20
+
+
+class ResultCache:
+    """
+    Results in shared memory segments, least recently used dropped first.
+
+    A result handed out is pinned until `release`: the client attaches to
+    the segment only after it reads the reply, so pinned results are never
+    closed by eviction, they wait over the budget until they are released.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_CACHE):
+        self.max_bytes = max_bytes
+        self._results = OrderedDict()
+        self._pins = Counter()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(result.array.nbytes for result in self._results.values())
+
+    def get(self, key: str):
+        """
+        The pinned result of `key` or None.
+        """
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._results.move_to_end(key)
+            self._pins[key] += 1
+            return result
+
+    def put(self, key: str, result: SharedArray, pins: int = 1):
+        with self._lock:
+            self._results[key] = result
+            self._pins[key] += pins
+            self._evict()
+
+    def release(self, key: str):
+        with self._lock:
+            self._pins[key] -= 1
+            if self._pins[key] <= 0:
+                del self._pins[key]
+            self._evict()
+
+    def _evict(self):
+        nbytes = self.nbytes
+        for key in list(self._results):
+            if nbytes <= self.max_bytes:
+                break
+            if len(self._results) > 1 and key not in self._pins:
+                result = self._results.pop(key)
+                nbytes -= result.array.nbytes
+                result.close()
+
+    def clear(self):
+        with self._lock:
+            for result in self._results.values():
+                result.close()
+            self._results.clear()
+            self._pins.clear()
+
+
+class Processor:
+    def __init__(self, backend: ProcessBackend = None, cache: ResultCache = None):
+        self.backend = backend
+        self.cache = cache or ResultCache()
+        # key -> [future, requests waiting on it]
+        self._running = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    @staticmethod
+    def key(rgb: np.ndarray, chain, input_key: str = None) -> str:
+        digest = hashlib.sha1(repr((rgb.shape, rgb.dtype.str, chain)).encode())
+        if input_key:
+            digest.update(input_key.encode())
+        else:
+            digest.update(np.ascontiguousarray(rgb).data)
+        return digest.hexdigest()
+
+    def _run(self, rgb: np.ndarray, chain) -> SharedArray:
+        if self.backend:
+            # workers write the result straight into the segment it is served from
+            shared = SharedArray(*self.backend.output_layout(rgb, chain))
+            try:
+                self.backend.apply(rgb, chain, shared)
+            except Exception:
+                shared.close()
+                raise
+            return shared
+
+        result = apply_chain(rgb, chain)
+        shared = SharedArray(result.shape, result.dtype)
+        shared.array[...] = result
+        if result is not rgb:
+            pool.give(result)
+        return shared
+
+    def apply(self, rgb: np.ndarray, chain, input_key: str = None):
+        """
+        (key, shared result, whether it came from the cache or a running
+        request).  The result stays pinned in the cache until
+        ``cache.release(key)``.
+        """
+        key = self.key(rgb, chain, input_key)
+        result = self.cache.get(key)
+        if result is not None:
+            return key, result, True
+
+        with self._lock:
+            running = self._running.get(key)
+            if running is None:
+                running = self._running[key] = [Future(), 0]
+                owner = True
+            else:
+                running[1] += 1
+                self.coalesced += 1
+                owner = False
+
+        if not owner:
+            # pinned for us by the request that ran it
+            return key, running[0].result(), True
+
+        try:
+            result = self._run(rgb, chain)
+        except Exception as e:
+            with self._lock:
+                del self._running[key]
+            running[0].set_exception(e)
+            raise
+
+        with self._lock:
+            del self._running[key]
+            self.cache.put(key, result, pins=1 + running[1])
+        running[0].set_result(result)
+        return key, result, False
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.cache.hits,
+            "misses": self.cache.misses,
+            "coalesced": self.coalesced,
+            "cached_bytes": self.cache.nbytes,
+        }
+
+
+def _read_input(spec: dict):
+    # returns the array and what has to be closed once it is not needed
+    if "npy" in spec:
+        return np.load(spec["npy"], mmap_mode="r"), None
+    shm = attach(spec["shm"])
+    return np.ndarray(tuple(spec["shape"]), np.dtype(spec["dtype"]), buffer=shm.buf), shm
+
+
+def _write_output(result: SharedArray, spec: dict = None) -> dict:
+    if spec and "npy" in spec:
+        out = np.lib.format.open_memmap(spec["npy"], mode="w+", dtype=result.dtype, shape=result.shape)
+        out[...] = result.array
+        out.flush()
+        return {"npy": spec["npy"]}
+
+    name, shape, dtype = result.spec
+    return {"shm": name, "shape": list(shape), "dtype": dtype}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # the result of a reply stays pinned until the client sends its next
+        # request or hangs up, by then it has copied it out of the segment
+        pinned = None
+        try:
+            for line in self.rfile:
+                if pinned is not None:
+                    self.server.processor.cache.release(pinned)
+                    pinned = None
+                try:
+                    response, pinned = self.server.respond(json.loads(line))
+                except Exception as e:
+                    response = {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+                self.wfile.flush()
+        finally:
+            if pinned is not None:
+                self.server.processor.cache.release(pinned)
+
+
+class ProcessingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str = DEFAULT_SOCKET, processor: Processor = None):
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, _Handler)
+        self.processor = processor or Processor()
+
+    def respond(self, request: dict):
+        """
+        (response, key of the result left pinned for the client or None)
+        """
+        cmd = request.get("cmd", "apply")
+        if cmd == "stats":
+            return dict(ok=True, **self.processor.stats()), None
+        if cmd != "apply":
+            raise ValueError("Unknown command `{}`".format(cmd))
+
+        chain = parse_chain(request["chain"])
+        rgb, shm = _read_input(request["input"])
+        try:
+            key, result, cached = self.processor.apply(rgb, chain, request.get("key"))
+        finally:
+            del rgb
+            if shm is not None:
+                shm.close()
+
+        spec = request.get("output")
+        try:
+            output = _write_output(result, spec)
+        except Exception:
+            self.processor.cache.release(key)
+            raise
+        if spec and "npy" in spec:
+            self.processor.cache.release(key)
+            key = None
+        return {"ok": True, "cached": cached, "output": output}, key
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        self.processor.cache.clear()
+        if self.processor.backend:
+            self.processor.backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--processes", type=int, default=os.cpu_count(),
+                        help="worker processes, 0 runs chains in the request threads")
+    parser.add_argument("--cache", default="512M", help="memory for cached results, e.g. 1G")
+    args = parser.parse_args()
+
+    warm_up()
+    backend = None
+    if args.processes:
+        backend = ProcessBackend(args.processes)
+        backend.warm_up()
+
+    server = ProcessingServer(args.socket, Processor(backend, ResultCache(parse_size(args.cache))))
+    # stopped by a service manager the same way as from the terminal
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print("Serving on {}".format(args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
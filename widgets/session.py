@@ -0,0 +1,203 @@
+"""
+Recording interaction sessions and replaying them for latency profiles.
+
+`SessionRecorder` watches a `ProgramWidget` and writes what the user does as
+JSON lines: mouse presses, drags, hovers and releases over the image, HSV
+slider changes, filter switches and opened files, each with the seconds
+since the recording started.  `SessionReplayer` feeds the same interactions
+to a `ProgramWidget` (it runs offscreen with ``QT_QPA_PLATFORM=offscreen``)
+at the recorded pace and times every one of them, its repaint included.
+Selection updates deferred to the next frame are timed on their own, as
+``selection``.
+
+    GRAPHEN_RECORD=session.jsonl python main.py
+    QT_QPA_PLATFORM=offscreen python replay_session.py session.jsonl
+"""
+import json
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
+from PyQt5.QtCore import QEvent, QObject, QPointF, Qt
+from PyQt5.QtGui import QImage, QMouseEvent
+from PyQt5.QtWidgets import QApplication
+
+VERSION = 1
+
+_MOUSE_EVENTS = {
+    QEvent.MouseButtonPress: "press",
+    QEvent.MouseMove: "move",
+    QEvent.MouseButtonRelease: "release",
+}
+_EVENT_TYPES = {name: kind for kind, name in _MOUSE_EVENTS.items()}
+
+
+class SessionRecorder(QObject):
+    def __init__(self, program_widget, fname: str):
+        super().__init__()
+        self.program_widget = program_widget
+        self._file = open(fname, "w")
+        self._start = time.perf_counter()
+
+        window = program_widget.window()
+        self.record("session", version=VERSION, size=[window.width(), window.height()])
+
+        program_widget.image_widget.installEventFilter(self)
+        program_widget.hsv_checkbox.toggled.connect(self._record_hsv)
+        for slider in (program_widget.h_slider, program_widget.s_slider, program_widget.v_slider):
+            slider.sliderReleased.connect(self._record_hsv)
+        program_widget.filter_rbtn.buttonClicked.connect(self._record_filter)
+        program_widget.sigma_slider.sliderReleased.connect(self._record_filter)
+
+    def record(self, kind: str, **data):
+        data = dict(type=kind, t=round(time.perf_counter() - self._start, 6), **data)
+        self._file.write(json.dumps(data) + "\n")
+        self._file.flush()
+
+    def eventFilter(self, obj, event):
+        kind = _MOUSE_EVENTS.get(event.type())
+        if kind is not None:
+            self.record(kind, x=event.x(), y=event.y(),
+                        button=int(event.button()), buttons=int(event.buttons()))
+        return False
+
+    def _record_hsv(self, *args):
+        widget = self.program_widget
+        self.record("hsv", checked=widget.hsv_checkbox.isChecked(),
+                    values=[widget.h_slider.value(), widget.s_slider.value(), widget.v_slider.value()])
+
+    def _record_filter(self, *args):
+        widget = self.program_widget
+        self.record("filter", id=widget.filter_rbtn.checkedId(), value=widget.sigma_slider.value())
+
+    def close(self):
+        self.program_widget.image_widget.removeEventFilter(self)
+        self._file.close()
+
+
+def read_session(fname: str) -> List[dict]:
+    with open(fname) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    if not events or events[0]["type"] != "session":
+        raise ValueError("`{}` is not a recorded session".format(fname))
+    if events[0]["version"] > VERSION:
+        raise ValueError("Session version {} is newer than {}".format(events[0]["version"], VERSION))
+    return events
+
+
+def percentiles(latencies: Dict[str, List[float]]) -> Dict[str, dict]:
+    report = {}
+    for kind, values in sorted(latencies.items()):
+        values = np.array(values) * 1000
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        report[kind] = {
+            "count": len(values), "p50": p50, "p95": p95, "p99": p99, "max": values.max(),
+        }
+    return report
+
+
+def format_report(report: Dict[str, dict]) -> str:
+    lines = ["{:>10} {:>6} {:>9} {:>9} {:>9} {:>9}".format("ms", "count", "p50", "p95", "p99", "max")]
+    for kind, row in report.items():
+        lines.append("{:>10} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+            kind, row["count"], row["p50"], row["p95"], row["p99"], row["max"]
+        ))
+    return "\n".join(lines)
+
+
+class SessionReplayer:
+    def __init__(self, program_widget, speed: float = 1):
+        """
+        `speed` scales the recorded pace, 0 replays as fast as possible.
+        """
+        self.program_widget = program_widget
+        self.speed = speed
+        self.latencies = defaultdict(list)
+
+        # time the deferred selection updates: the timer's own slot runs
+        # between the two added ones
+        image_widget = program_widget.image_widget
+        timer = image_widget._selection_timer
+        timer.timeout.disconnect()
+        timer.timeout.connect(self._selection_started)
+        timer.timeout.connect(image_widget._emit_selection_update)
+        timer.timeout.connect(self._selection_finished)
+        self._selection_start = None
+
+    def _selection_started(self):
+        self._selection_start = time.perf_counter()
+
+    def _selection_finished(self):
+        self.latencies["selection"].append(time.perf_counter() - self._selection_start)
+
+    def _mouse(self, event: dict) -> str:
+        kind = event["type"]
+        buttons = Qt.MouseButtons(event["buttons"])
+        if kind == "move":
+            kind = "drag" if event["buttons"] else "hover"
+
+        mouse_event = QMouseEvent(_EVENT_TYPES[event["type"]], QPointF(event["x"], event["y"]),
+                                  Qt.MouseButton(event["button"]), buttons, Qt.NoModifier)
+        QApplication.sendEvent(self.program_widget.image_widget, mouse_event)
+        return kind
+
+    def _hsv(self, event: dict) -> str:
+        widget = self.program_widget
+        for control, value in ((widget.h_slider, event["values"][0]),
+                               (widget.s_slider, event["values"][1]),
+                               (widget.v_slider, event["values"][2])):
+            control.setValue(value)
+        widget.hsv_checkbox.blockSignals(True)
+        widget.hsv_checkbox.setChecked(event["checked"])
+        widget.hsv_checkbox.blockSignals(False)
+        widget.slider_update()
+        return "hsv"
+
+    def _filter(self, event: dict) -> str:
+        widget = self.program_widget
+        widget.filter_rbtn.button(event["id"]).setChecked(True)
+        widget._update_sigma_slider(event["id"])
+        widget.sigma_slider.setValue(event["value"])
+        widget._filter_change()
+        return "filter"
+
+    def _open(self, event: dict) -> str:
+        # decoded in full right away, previews and the disk cache would
+        # make the numbers depend on what ran before
+        self.program_widget.set_image(QImage(event["fname"]))
+        return "open"
+
+    def play(self, events: List[dict]) -> Dict[str, List[float]]:
+        handlers = {
+            "press": self._mouse, "move": self._mouse, "release": self._mouse,
+            "hsv": self._hsv, "filter": self._filter, "open": self._open,
+        }
+        header, events = events[0], events[1:]
+        self.program_widget.window().resize(*header["size"])
+        QApplication.processEvents()
+
+        start = time.perf_counter()
+        for event in events:
+            if self.speed:
+                # wait for the recorded moment, handling what is due meanwhile
+                due = start + event["t"] / self.speed
+                while time.perf_counter() < due:
+                    QApplication.processEvents()
+                    time.sleep(max(min(due - time.perf_counter(), 0.001), 0))
+
+            began = time.perf_counter()
+            kind = handlers[event["type"]](event)
+            QApplication.processEvents()
+            self.latencies[kind].append(time.perf_counter() - began)
+
+        # the last deferred selection update
+        timer = self.program_widget.image_widget._selection_timer
+        while timer.isActive():
+            QApplication.processEvents()
+            time.sleep(0.001)
+
+        return self.latencies
+
+    def report(self) -> Dict[str, dict]:
+        return percentiles(self.latencies)
@@ -0,0 +1,22 @@
+"""
+Attaching to shared memory segments created by another process.
+
+Kept free of Qt and scipy: ``client.py`` imports it with numpy alone.
+"""
+from multiprocessing import resource_tracker, shared_memory
+
+
+def attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+
+    # before 3.13 every attachment is registered with the resource tracker,
+    # which would unlink the segment under its owner when this process exits
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
@@ -0,0 +1,222 @@
+"""
+Streaming a chain of operations over frame sequences and videos.
+
+Frames come from numbered images (a glob, or a directory) or, when OpenCV
+is installed, from a video file.  A pool of workers decodes and processes
+them; at most ``queue_size`` frames are in flight, and results are written
+in input order as soon as they are ready.
+
+    python -m widgets.stream "scans/*.png" "out/%05d.png" --op hsv:30,0,0 --op gaussian:2
+
+With ``--processes`` every frame is split in tiles over a pool of processes
+(see ``parallel.py``) instead of running whole in one thread.
+"""
+import argparse
+import glob
+import os
+import re
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from .memory import pool
+from .operations import apply_chain, parse_chain
+from .parallel import ProcessBackend
+from .processing import pixels, to_qimage
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mkv", ".mov")
+
+
+def _natural_key(name: str):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def sequence_files(pattern: str):
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*")
+    return sorted(glob.glob(pattern), key=_natural_key)
+
+
+def read_image(fname: str) -> np.ndarray:
+    image = QImage(fname)
+    if image.isNull():
+        raise ValueError("Can't read `{}`".format(fname))
+    return pixels(image)
+
+
+def read_video(fname: str) -> Iterator[np.ndarray]:
+    if cv2 is None:
+        raise RuntimeError("Reading video needs OpenCV (pip install opencv-python)")
+
+    capture = cv2.VideoCapture(fname)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA)
+    finally:
+        capture.release()
+
+
+class SequenceWriter:
+    def __init__(self, pattern: str):
+        try:
+            first, second = pattern % 0, pattern % 1
+        except (TypeError, ValueError):
+            first = second = None
+        if first is None or first == second:
+            raise ValueError(
+                "Frames are written to a printf pattern with one integer field, "
+                "e.g. out/%05d.png, not `{}`".format(pattern)
+            )
+        self.pattern = pattern
+        directory = os.path.dirname(first)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, index: int, frame: np.ndarray):
+        to_qimage(frame).save(self.pattern % index)
+
+    def close(self):
+        pass
+
+
+class VideoWriter:
+    def __init__(self, fname: str, fps: float = 25):
+        if cv2 is None:
+            raise RuntimeError("Writing video needs OpenCV (pip install opencv-python)")
+        self.fname = fname
+        self.fps = fps
+        self._writer = None
+
+    def write(self, index: int, frame: np.ndarray):
+        if self._writer is None:
+            fourcc = cv2.VideoWriter_fourcc(*("mp4v" if self.fname.endswith(".mp4") else "MJPG"))
+            self._writer = cv2.VideoWriter(self.fname, fourcc, self.fps, (frame.shape[1], frame.shape[0]))
+        if frame.ndim == 2:
+            frame = np.dstack([frame, frame, frame])
+        self._writer.write(np.ascontiguousarray(frame[..., 2::-1]))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+
+
+class StreamStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.frames = 0
+        self.latency = defaultdict(list)
+
+    def add(self, stage: str, seconds: float):
+        self.latency[stage].append(seconds)
+
+    @property
+    def fps(self) -> float:
+        return self.frames / max(time.perf_counter() - self.start, 1e-9)
+
+    def report(self) -> str:
+        lines = ["{} frames, {:.2f} fps".format(self.frames, self.fps)]
+        for stage, values in self.latency.items():
+            values = np.array(values) * 1000
+            lines.append("{:>8}: mean {:.1f}ms, p50 {:.1f}ms, p95 {:.1f}ms".format(
+                stage, values.mean(), np.percentile(values, 50), np.percentile(values, 95)
+            ))
+        return "\n".join(lines)
+
+
+def _process(source, chain, stats: StreamStats, backend: ProcessBackend = None):
+    start = time.perf_counter()
+    frame = read_image(source) if isinstance(source, str) else source
+    decoded = time.perf_counter()
+    result = backend.apply(frame, chain) if backend else apply_chain(frame, chain)
+    if result is not frame:
+        pool.give(frame)
+    stats.add("read", decoded - start)
+    stats.add("process", time.perf_counter() - decoded)
+    return result
+
+
+def process_stream(sources, chain, workers: int = None, queue_size: int = None,
+                   stats: StreamStats = None, backend: ProcessBackend = None) -> Iterator[np.ndarray]:
+    """
+    Processed frames in the order of `sources` (file names or arrays).
+    """
+    workers = workers or os.cpu_count()
+    queue_size = queue_size or 2 * workers
+    stats = stats or StreamStats()
+
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        for source in sources:
+            if len(pending) >= queue_size:
+                yield pending.popleft().result()
+            pending.append(executor.submit(_process, source, chain, stats, backend))
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def run(src: str, dst: str, chain, workers: int = None, queue_size: int = None,
+        stats: StreamStats = None, backend: ProcessBackend = None) -> StreamStats:
+    stats = stats or StreamStats()
+
+    if src.lower().endswith(VIDEO_EXTENSIONS):
+        sources = read_video(src)
+    else:
+        sources = sequence_files(src)
+
+    if dst.lower().endswith(VIDEO_EXTENSIONS):
+        writer = VideoWriter(dst)
+    else:
+        writer = SequenceWriter(dst)
+
+    try:
+        for index, frame in enumerate(process_stream(sources, chain, workers, queue_size, stats, backend)):
+            start = time.perf_counter()
+            writer.write(index, frame)
+            stats.add("write", time.perf_counter() - start)
+            stats.frames += 1
+            pool.give(frame)
+    finally:
+        writer.close()
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="glob of frames, a directory, or a video file")
+    parser.add_argument("output", help="printf pattern of frames (out/%%05d.png) or a video file")
+    parser.add_argument("--op", action="append", default=[], help="operation[:arg,...]")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--queue", type=int, default=None, help="frames in flight")
+    parser.add_argument("--processes", type=int, default=0, help="split frames over processes")
+    args = parser.parse_args()
+
+    backend = None
+    if args.processes:
+        backend = ProcessBackend(args.processes)
+        backend.warm_up()
+
+    try:
+        stats = run(args.input, args.output, parse_chain(args.op), args.workers, args.queue,
+                    backend=backend)
+    finally:
+        if backend:
+            backend.close()
+    print(stats.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Out-of-core processing of images that do not fit in memory.
+
+An input is decoded once into a memory-mapped ``.npy`` store of RGBA bytes,
+next to the input or in ``store_dir`` (``DEFAULT_STORE_DIR`` when the
+input's folder is read-only), and reused while it is newer than the input.
+The store is written under a temporary name and renamed once complete, so
+an interrupted decode never leaves a store that looks finished.  A chain of
+operations (see ``operations.py``) then runs over row strips with enough halo
+rows for the neighbourhood filters and writes to a memory-mapped output.
+Strip height is chosen so the working set stays within ``budget`` bytes, and
+finished strips are written out and dropped from memory.
+
+Binary PPM / PGM inputs are streamed into the store strip by strip.  Qt's
+decoders can't resume in the middle of an image, so other formats are
+decoded whole, once, and only when they fit in the memory budget of
+`memory.accountant`; convert larger images to PPM first.
+
+    python -m widgets.strips scan.tif out.npy --op hsv:30,0,0 --op median:5
+"""
+import argparse
+import hashlib
+import mmap
+import os
+
+import numpy as np
+from PyQt5.QtGui import QImage, QImageReader
+
+from .memory import accountant, parse_size
+from .operations import GLOBAL_OPERATIONS, apply_chain, chain_halo, is_local, parse_chain
+from .processing import qimageview, array_image
+
+# rough working set of the heaviest operation (float64 HSV planes and
+# temporaries of `_rgb_to_hsv` / `_hsv_to_rgb`) per pixel of a strip
+_BYTES_PER_PIXEL = 192
+
+DEFAULT_BUDGET = 256 * 2 ** 20
+
+# stores of inputs in read-only folders, apart from the image cache which
+# evicts whatever is in its folder
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "graphen-strips")
+
+
+def strip_rows(width: int, halo: int, budget: int = DEFAULT_BUDGET) -> int:
+    rows = budget // (width * _BYTES_PER_PIXEL) - 2 * halo
+    # a budget below the halo would recompute every row many times over
+    return max(rows, halo, 1)
+
+
+def _to_rgba(image: QImage) -> np.ndarray:
+    return qimageview(image.convertToFormat(QImage.Format_ARGB32))
+
+
+def release(array: np.ndarray, top: int, bottom: int):
+    """
+    Writes rows [top, bottom) of a memory-mapped array to disk and drops them
+    from memory, so only the strip in work stays resident.  Other arrays are
+    left alone.
+    """
+    buffer = getattr(array, "_mmap", None)
+    if buffer is None or bottom <= top:
+        return
+
+    # np.memmap maps from an allocation boundary before the array's offset
+    start = array.offset % mmap.ALLOCATIONGRANULARITY + top * array.strides[0]
+    stop = start + (bottom - top) * array.strides[0]
+    # whole pages only, the last one may hold rows of the next strip
+    start -= start % mmap.PAGESIZE
+    stop -= stop % mmap.PAGESIZE
+    if stop <= start:
+        return
+
+    buffer.flush(start, stop - start)
+    if hasattr(buffer, "madvise"):
+        buffer.madvise(mmap.MADV_DONTNEED, start, stop - start)
+
+
+def _netpbm_header(f):
+    """
+    (channels, width, height, maxval) of a binary PGM / PPM, the file is left
+    at the first pixel; None for other files.
+    """
+    magic = f.read(2)
+    if magic not in (b"P5", b"P6"):
+        return None
+
+    fields = []
+    while len(fields) < 3:
+        token = b""
+        char = f.read(1)
+        while char.isspace() or char == b"#":
+            if char == b"#":
+                f.readline()
+            char = f.read(1)
+        while char and not char.isspace():
+            token += char
+            char = f.read(1)
+        if not token:
+            raise ValueError("Truncated header of `{}`".format(f.name))
+        fields.append(int(token))
+    # a single whitespace byte after maxval is already read
+
+    return (1 if magic == b"P5" else 3), fields[0], fields[1], fields[2]
+
+
+def _stream_netpbm(fname: str, store: str, header, offset: int, budget: int) -> np.ndarray:
+    channels, width, height, maxval = header
+    dtype = ">u2" if maxval > 255 else np.uint8
+    src = np.memmap(fname, dtype, "r", offset, shape=(height, width, channels))
+    out = np.lib.format.open_memmap(store, mode="w+", dtype=np.uint8, shape=(height, width, 4))
+
+    rows = max(budget // (width * 4 * 2), 1)
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        strip = np.asarray(src[top:bottom])
+        if maxval != 255:
+            strip = (strip.astype(np.uint32) * 255 + maxval // 2) // maxval
+        out[top:bottom, :, :3] = strip
+        out[top:bottom, :, 3] = 255
+        release(out, top, bottom)
+        release(src, top, bottom)
+
+    out.flush()
+    return out
+
+
+def decode_to_store(fname: str, store: str, budget: int = DEFAULT_BUDGET) -> np.ndarray:
+    tmp = store + ".tmp"
+    try:
+        out = _decode(fname, tmp, budget)
+        os.replace(tmp, store)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return out
+
+
+def _decode(fname: str, store: str, budget: int) -> np.ndarray:
+    with open(fname, "rb") as f:
+        header = _netpbm_header(f)
+        offset = f.tell()
+    if header is not None:
+        return _stream_netpbm(fname, store, header, offset, budget)
+
+    reader = QImageReader(fname)
+    size = reader.size()
+    if not size.isValid():
+        raise ValueError("Can't read `{}`: {}".format(fname, reader.errorString()))
+
+    width, height = size.width(), size.height()
+    # the decoded image and its RGBA conversion
+    needed = 2 * width * height * 4
+    if needed > accountant.budget:
+        raise ValueError(
+            "`{}` can't be decoded in strips and needs {:.0f}M to decode whole, over the {:.0f}M budget; "
+            "convert it to PPM / PGM".format(fname, needed / 2 ** 20, accountant.budget / 2 ** 20)
+        )
+
+    image = reader.read()
+    if image.isNull():
+        raise ValueError("Can't read `{}`: {}".format(fname, reader.errorString()))
+
+    out = np.lib.format.open_memmap(store, mode="w+", dtype=np.uint8, shape=(height, width, 4))
+    out[:] = _to_rgba(image)
+    release(out, 0, height)
+    out.flush()
+    return out
+
+
+def store_path(fname: str, store_dir: str = None) -> str:
+    """
+    Where the store of `fname` goes: next to it, or in `store_dir` (by
+    default `DEFAULT_STORE_DIR` when the input's folder is read-only) under
+    a name that tells apart inputs of the same name.
+    """
+    directory = os.path.dirname(os.path.abspath(fname))
+    if store_dir is None:
+        if os.access(directory, os.W_OK):
+            return fname + ".npy"
+        store_dir = DEFAULT_STORE_DIR
+
+    os.makedirs(store_dir, exist_ok=True)
+    digest = hashlib.sha1(os.path.abspath(fname).encode()).hexdigest()[:16]
+    return os.path.join(store_dir, "{}.{}.npy".format(os.path.basename(fname), digest))
+
+
+def open_store(fname: str, budget: int = DEFAULT_BUDGET, store_dir: str = None) -> np.ndarray:
+    if fname.endswith(".npy"):
+        return np.load(fname, mmap_mode="r")
+
+    store = store_path(fname, store_dir)
+    if os.path.exists(store) and os.path.getmtime(store) >= os.path.getmtime(fname):
+        return np.load(store, mmap_mode="r")
+
+    return decode_to_store(fname, store, budget)
+
+
+def process_strips(src: np.ndarray, out: np.ndarray, chain, budget: int = DEFAULT_BUDGET):
+    if not is_local(chain):
+        raise ValueError("Operations of the whole image can't run in strips: {}".format(
+            ", ".join(name for name, *args in chain if name in GLOBAL_OPERATIONS)
+        ))
+
+    height, width = src.shape[:2]
+    halo = chain_halo(chain)
+    rows = strip_rows(width, halo, budget)
+
+    for top in range(0, height, rows):
+        yield top / height
+        bottom = min(top + rows, height)
+        start, stop = max(top - halo, 0), min(bottom + halo, height)
+
+        strip = apply_chain(np.array(src[start:stop]), chain)
+        out[top:bottom] = strip[top - start:bottom - start]
+        release(out, top, bottom)
+        # rows above the halo of the next strip are not read again
+        release(src, max(top - halo, 0), max(bottom - halo, 0))
+
+    yield 1
+    yield out
+
+
+def process_file(fname: str, out_fname: str, chain, budget: int = DEFAULT_BUDGET, store_dir: str = None):
+    src = open_store(fname, budget, store_dir)
+    out = np.lib.format.open_memmap(out_fname, mode="w+", dtype=np.uint8, shape=src.shape)
+
+    for x in process_strips(src, out, chain, budget):
+        yield x
+
+    out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="image or .npy store")
+    parser.add_argument("output", help=".npy store, or an image file to save")
+    parser.add_argument("--op", action="append", default=[], help="operation[:arg,...]")
+    parser.add_argument("--budget", default="256M", help="memory for one strip, e.g. 512M")
+    parser.add_argument("--store-dir", default=None, help="folder of decoded stores, next to the input by default")
+    args = parser.parse_args()
+
+    chain = parse_chain(args.op)
+    budget = parse_size(args.budget)
+
+    if args.output.endswith(".npy"):
+        out_store = args.output
+    else:
+        out_store = args.output + ".npy"
+
+    x = None
+    for x in process_file(args.input, out_store, chain, budget, args.store_dir):
+        if isinstance(x, float):
+            print("\rProcessing {:.1f}%".format(x * 100), end="")
+    print()
+
+    if out_store != args.output:
+        array_image(np.load(out_store, mmap_mode="r")).save(args.output)
+        os.remove(out_store)
+
+
+if __name__ == '__main__':
+    main()
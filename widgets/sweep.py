@@ -0,0 +1,419 @@
+"""
+Parameter sweeps: one operation over a grid of arguments, as a contact sheet.
+
+Trying arguments one at a time reruns the whole operation on the same
+source.  `Sweep` computes what the variants share once and keeps it for the
+next sweep of the same source: the source itself (decoded, rescaled to the
+size of a cell and run through a fixed chain), its HSV planes for ``hsv``,
+its spectrum for ``gaussian`` and ``gabor`` (every variant is then a product
+in the frequency domain and one inverse transform) and its colour histogram
+for ``quantize``.  HSV variants are converted back in vectorized batches;
+the batches, and the variants of the other operations, run over a pool of
+threads.
+
+Gaussian variants are rounded from the exact convolution, so they are within
+2 levels of `_gaussian` (scipy truncates after every axis).  Other
+operations run whole for every variant.
+
+    python -m widgets.sweep photo.jpg sheet.png hsv --axis=-180,-90,0,90 --axis=0,50 --axis=0 --size 320
+"""
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from PyQt5.QtCore import QRect, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QPainter
+from PyQt5.QtWidgets import QWidget
+
+from .gabor import _gabor_energy, gabor_kernel
+from .memory import pool
+from .operations import OPERATIONS, apply_chain, parse_chain
+from .processing import _depth_max, _rgb_to_hsv, native, pixels, to_qimage, warm_up
+from .quantize import _features, _paint, colour_histogram, weighted_kmeans
+
+# elements of the HSV planes of one batch, their float64 temporaries stay in cache
+_BATCH_ELEMENTS = 1 << 18
+
+
+def parameter_grid(*axes: Sequence) -> List[Tuple]:
+    """
+    >>> parameter_grid([0, 90], [0], [-10, 10])
+    [(0, 0, -10), (0, 0, 10), (90, 0, -10), (90, 0, 10)]
+    """
+    return list(itertools.product(*axes))
+
+
+def _gaussian_radius(sigma) -> int:
+    # scipy's gaussian_filter truncates the kernel at 4 sigma
+    return int(4 * sigma + 0.5)
+
+
+def _gaussian_transfer(sigma, size: int, half: bool) -> np.ndarray:
+    """
+    DFT over `size` samples of the gaussian_filter kernel, only the
+    non-negative frequencies when `half` (the last axis of rfft2).
+    """
+    frequencies = np.arange(size // 2 + 1 if half else size)
+    if sigma <= 0:
+        return np.ones(len(frequencies))
+
+    x = np.arange(-_gaussian_radius(sigma), _gaussian_radius(sigma) + 1)
+    kernel = np.exp(-0.5 / sigma ** 2 * x ** 2)
+    kernel /= kernel.sum()
+    # the kernel is symmetric, its transform is real
+    return kernel @ np.cos(2 * np.pi / size * np.outer(x, frequencies))
+
+
+def _planes(rgb: np.ndarray) -> np.ndarray:
+    # colour channels first, grey images as one plane
+    return rgb[None] if rgb.ndim == 2 else np.moveaxis(rgb[..., :3], -1, 0)
+
+
+def _store(result: np.ndarray, planes, rgb: np.ndarray):
+    if rgb.ndim == 2:
+        result[...] = planes[0]
+        return
+    for c in range(3):
+        result[..., c] = planes[c]
+    result[..., 3:] = rgb[..., 3:]
+
+
+class Sweep:
+    def __init__(self, rgb: np.ndarray, chain=(), workers: int = None):
+        """
+        `rgb` runs through the fixed `chain` once, every variant starts from
+        the result.
+        """
+        self.rgb = apply_chain(rgb, chain) if chain else rgb
+        self.workers = workers or os.cpu_count()
+        self._prefixes = {}
+
+    @classmethod
+    def from_image(cls, image: QImage, size: int = None, chain=(), workers: int = None) -> "Sweep":
+        # rescaled once, to the size of a contact sheet cell
+        if size and max(image.width(), image.height()) > size:
+            image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        return cls(pixels(native(image)), chain, workers)
+
+    def run(self, name: str, variants: Sequence[Tuple]) -> List[np.ndarray]:
+        """
+        Results of operation `name` with each of `variants` (tuples of its
+        arguments), in order.  The arrays come from `memory.pool`.
+        """
+        if name not in OPERATIONS:
+            raise ValueError("Unknown operation `{}`, may be one of {}".format(name, ", ".join(OPERATIONS)))
+
+        variants = [tuple(args) for args in variants]
+        shared = {
+            "hsv": (self._hsv_planes, self._hsv_batch),
+            "gaussian": (self._gaussian_spectrum, self._gaussian),
+            "gabor": (self._gabor_spectrum, self._gabor),
+            "quantize": (self._histogram, self._quantize),
+        }
+        if name in shared and not (name == "hsv" and self.rgb.ndim == 2):
+            prefix, remainder = shared[name]
+            # computed here, before the workers share it
+            prefix = prefix(variants)
+        else:
+            prefix, remainder = None, self._whole(name)
+
+        size = 1
+        if name == "hsv":
+            size = max(_BATCH_ELEMENTS // (self.rgb.shape[0] * self.rgb.shape[1]), 1)
+        batches = [variants[i:i + size] for i in range(0, len(variants), size)]
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            results = executor.map(lambda batch: remainder(prefix, batch), batches)
+            return [result for batch in results for result in batch]
+
+    def _cached(self, name: str, key, compute):
+        if name not in self._prefixes or self._prefixes[name][0] != key:
+            self._prefixes[name] = key, compute()
+        return self._prefixes[name][1]
+
+    def _whole(self, name: str):
+        function = OPERATIONS[name][0]
+
+        def run(_, batch):
+            return [function(self.rgb, *args) for args in batch]
+        return run
+
+    # hsv
+
+    def _hsv_planes(self, variants):
+        def compute():
+            hsv = _rgb_to_hsv(self.rgb, _depth_max(self.rgb))
+            return hsv[..., 0].copy(), hsv[..., 1].copy(), hsv[..., 2].copy()
+        return self._cached("hsv", None, compute)
+
+    def _hsv_batch(self, planes, batch) -> List[np.ndarray]:
+        h, s, v = planes
+        rgb, vmax = self.rgb, _depth_max(self.rgb)
+
+        shifts = np.array(batch, dtype=np.float64)[:, :, None, None]
+        hue = (h + shifts[:, 0]) % 360 / 60
+        saturation = np.clip(s + shifts[:, 1], 0, 100) * 0.01
+        value = np.clip(v + shifts[:, 2], 0, 100) * (vmax / 100)
+
+        results = [pool.take(rgb.shape, rgb.dtype) for _ in batch]
+        # the branchless form of `_hsv_to_rgb`: channel n is
+        # v * (1 - s * clip(min(k, 4 - k), 0, 1)) with k = (n + h / 60) % 6
+        k, m = np.empty_like(hue), np.empty_like(hue)
+        for c, n in enumerate((5, 3, 1)):
+            np.add(hue, n, out=k)
+            np.remainder(k, 6, out=k)
+            np.subtract(4, k, out=m)
+            np.minimum(k, m, out=m)
+            np.clip(m, 0, 1, out=m)
+            m *= saturation
+            np.subtract(1, m, out=m)
+            m *= value
+            np.clip(m, 0, vmax, out=m)
+            for result, plane in zip(results, m):
+                result[..., c] = plane
+        for result in results:
+            result[..., 3:] = rgb[..., 3:]
+        return results
+
+    # gaussian
+
+    def _gaussian_spectrum(self, variants):
+        from scipy.fft import next_fast_len, rfft2
+
+        pad = max(_gaussian_radius(sigma) for sigma, *_ in variants)
+
+        def compute():
+            # reflected like gaussian_filter's default mode
+            padded = np.pad(_planes(self.rgb).astype(np.float32), ((0, 0), (pad, pad), (pad, pad)), "symmetric")
+            shape = tuple(next_fast_len(n, real=True) for n in padded.shape[1:])
+            return pad, shape, rfft2(padded, shape)
+        # a wider padding serves smaller sigmas as well
+        cached = self._prefixes.get("gaussian")
+        if cached and cached[0] >= pad:
+            return cached[1]
+        return self._cached("gaussian", pad, compute)
+
+    def _gaussian(self, spectrum, batch) -> List[np.ndarray]:
+        from scipy.fft import irfft2
+
+        pad, shape, spectrum = spectrum
+        rgb, vmax = self.rgb, _depth_max(self.rgb)
+        height, width = rgb.shape[:2]
+
+        results = []
+        for sigma, *_ in batch:
+            transfer = _gaussian_transfer(sigma, shape[0], False)[:, None] * _gaussian_transfer(sigma, shape[1], True)
+            planes = irfft2(spectrum * transfer.astype(np.float32), shape)[:, pad:pad + height, pad:pad + width]
+
+            result = pool.take(rgb.shape, rgb.dtype)
+            _store(result, np.clip(planes + 0.5, 0, vmax), rgb)
+            results.append(result)
+        return results
+
+    # gabor
+
+    def _gabor_spectrum(self, variants):
+        from scipy.fft import fft2, next_fast_len
+
+        kernels = [gabor_kernel(1, theta=theta).shape for theta, *_ in variants]
+        needed = [n + max(k[axis] for k in kernels) - 1 for axis, n in enumerate(self.rgb.shape[:2])]
+
+        def compute():
+            # zero padded like convolve2d's default boundary
+            shape = tuple(next_fast_len(n) for n in needed)
+            return shape, fft2(_planes(self.rgb).astype(np.float64), shape)
+        cached = self._prefixes.get("gabor")
+        if cached and all(have >= need for have, need in zip(cached[1][0], needed)):
+            return cached[1]
+        return self._cached("gabor", tuple(needed), compute)
+
+    def _gabor(self, spectrum, batch) -> List[np.ndarray]:
+        from scipy.fft import fft2, ifft2
+
+        shape, spectrum = spectrum
+        rgb = self.rgb
+        height, width = rgb.shape[:2]
+
+        results = []
+        for theta, *_ in batch:
+            kernel = gabor_kernel(1, theta=theta)
+            top, left = (kernel.shape[0] - 1) // 2, (kernel.shape[1] - 1) // 2
+            response = ifft2(spectrum * fft2(kernel, shape))[:, top:top + height, left:left + width]
+
+            real = pool.take(rgb.shape, rgb.dtype)
+            imag = pool.take(rgb.shape, rgb.dtype)
+            _store(real, response.real, rgb)
+            _store(imag, response.imag, rgb)
+            results.append(_gabor_energy(rgb, real, imag))
+        return results
+
+    # quantize
+
+    def _histogram(self, variants):
+        histogram = self._cached("quantize", None, lambda: (colour_histogram(self.rgb), {}))
+        (_, _, _, colours), features = histogram
+        for _, *space in variants:
+            space = space[0] if space else "Lab"
+            if space not in features:
+                features[space] = _features(colours, _depth_max(self.rgb), space)
+        return histogram
+
+    def _quantize(self, histogram, batch) -> List[np.ndarray]:
+        (index, bins, weights, colours), features = histogram
+        results = []
+        for k, *space in batch:
+            labels, _ = weighted_kmeans(features[space[0] if space else "Lab"], weights, k)
+            results.append(_paint(self.rgb, index, bins, weights, colours, labels))
+        return results
+
+
+def _as_rgba8(array: np.ndarray) -> np.ndarray:
+    if array.dtype == np.uint16:
+        array = (array >> 8).astype(np.uint8)
+    if array.ndim == 2:
+        array = np.dstack([array, array, array])
+    if array.shape[2] == 3:
+        array = np.dstack([array, np.full(array.shape[:2], 255, np.uint8)])
+    return array
+
+
+def format_arguments(args: Tuple) -> str:
+    """
+    >>> format_arguments((30, 0.5, -10.0))
+    '30, 0.5, -10'
+    """
+    return ", ".join("{:g}".format(arg) if isinstance(arg, (int, float)) else str(arg) for arg in args)
+
+
+class ContactSheet:
+    """
+    Results tiled row by row in cells of the size of the largest one, each
+    with its label written in a corner.
+    """
+    def __init__(self, results: Sequence[np.ndarray], labels: Sequence[str] = None, columns: int = None,
+                 gap: int = 4):
+        self.count = len(results)
+        self.columns = columns or int(np.ceil(np.sqrt(self.count)))
+        self.rows = -(-self.count // self.columns)
+        self.cell_height = max(result.shape[0] for result in results)
+        self.cell_width = max(result.shape[1] for result in results)
+        self.gap = gap
+
+        sheet = np.zeros((self.rows * (self.cell_height + gap) + gap,
+                          self.columns * (self.cell_width + gap) + gap, 4), np.uint8)
+        sheet[..., 3] = 255
+        for index, result in enumerate(results):
+            rect = self.cell_rect(index)
+            sheet[rect.top():rect.top() + result.shape[0], rect.left():rect.left() + result.shape[1]] = \
+                _as_rgba8(result)
+        self.image = to_qimage(sheet)
+
+        if labels:
+            painter = QPainter(self.image)
+            for index, label in enumerate(labels):
+                rect = self.cell_rect(index).adjusted(3, 0, 0, -2)
+                painter.setPen(QColor(0, 0, 0))
+                painter.drawText(rect.translated(1, 1), Qt.AlignLeft | Qt.AlignBottom, label)
+                painter.setPen(QColor(255, 255, 255))
+                painter.drawText(rect, Qt.AlignLeft | Qt.AlignBottom, label)
+            painter.end()
+
+    def cell_rect(self, index: int) -> QRect:
+        row, column = divmod(index, self.columns)
+        return QRect(self.gap + column * (self.cell_width + self.gap), self.gap + row * (self.cell_height + self.gap),
+                     self.cell_width, self.cell_height)
+
+    def index_at(self, x: int, y: int):
+        """
+        Index of the cell at the sheet pixel (x, y), None between cells.
+        """
+        column, x = divmod(x - self.gap, self.cell_width + self.gap)
+        row, y = divmod(y - self.gap, self.cell_height + self.gap)
+        index = row * self.columns + column
+        if 0 <= column < self.columns and 0 <= index < self.count and x < self.cell_width and y < self.cell_height:
+            return index
+        return None
+
+
+class ContactSheetWidget(QWidget):
+    # index of the clicked cell
+    chosen = pyqtSignal(int)
+
+    def __init__(self, sheet: ContactSheet, title: str):
+        super().__init__()
+        self.sheet = sheet
+        self.setWindowTitle(title)
+        self.resize(min(sheet.image.width(), 1280), min(sheet.image.height(), 960))
+
+    def _scale(self) -> float:
+        return min(self.width() / self.sheet.image.width(), self.height() / self.sheet.image.height())
+
+    def paintEvent(self, event):
+        scale = self._scale()
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
+        painter.drawImage(QRect(0, 0, int(self.sheet.image.width() * scale), int(self.sheet.image.height() * scale)),
+                          self.sheet.image)
+        painter.end()
+
+    def mousePressEvent(self, event):
+        scale = self._scale()
+        index = self.sheet.index_at(int(event.x() / scale), int(event.y() / scale))
+        if index is not None:
+            self.chosen.emit(index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="source image")
+    parser.add_argument("output", help="contact sheet image")
+    parser.add_argument("operation", choices=list(OPERATIONS))
+    parser.add_argument("--axis", action="append", default=[],
+                        help="values of the next argument, comma separated (--axis=-90,0,90)")
+    parser.add_argument("--pre", action="append", default=[], help="operation[:arg,...] run once before the sweep")
+    parser.add_argument("--size", type=int, default=None, help="largest side of a cell")
+    parser.add_argument("--columns", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--compare", action="store_true", help="also time every variant run on its own")
+    args = parser.parse_args()
+
+    axes = [[float(value) for value in axis.split(",")] for axis in args.axis]
+    if args.operation == "quantize" and axes:
+        axes[0] = [int(k) for k in axes[0]]
+    variants = parameter_grid(*axes)
+
+    image = QImage(args.input)
+    if image.isNull():
+        raise SystemExit("Can't read `{}`".format(args.input))
+
+    if args.compare:
+        # imports would count against whichever runs first
+        warm_up().join()
+
+    start = time.perf_counter()
+    sweep = Sweep.from_image(image, args.size, parse_chain(args.pre), args.workers)
+    prepared = time.perf_counter()
+    results = sweep.run(args.operation, variants)
+    elapsed = time.perf_counter() - prepared
+    print("source prepared in {:.3f}s, {} variants in {:.3f}s".format(prepared - start, len(variants), elapsed))
+
+    if args.compare:
+        function = OPERATIONS[args.operation][0]
+        start = time.perf_counter()
+        for variant in variants:
+            pool.give(function(sweep.rgb, *variant))
+        independent = time.perf_counter() - start
+        print("one by one in {:.3f}s, {:.1f}x".format(independent, independent / elapsed))
+
+    sheet = ContactSheet(results, [format_arguments(variant) for variant in variants], args.columns)
+    sheet.image.save(args.output)
+    for result in results:
+        pool.give(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""
+Incremental processing of a folder that keeps receiving images.
+
+A manifest (SQLite, next to the outputs) remembers for every input its size,
+mtime, content hash and the chain its output was made with.  A pass stats
+every file, hashes only those whose size or mtime changed, and processes
+only new inputs, changed contents or inputs made with another chain, on a
+pool of worker processes.  Rows are written in transactions of a batch of
+results, so the manifest is never left half written and a pass over 100k
+up-to-date files costs a directory scan and one query.
+
+    python -m widgets.watch incoming/ processed/ --op hsv:30,0,0 --op median:3
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Tuple
+
+from PyQt5.QtGui import QImage, QImageReader
+
+from .operations import apply_chain, parse_chain
+from .parallel import _context
+from .processing import pixels, to_qimage
+
+MANIFEST = ".manifest.sqlite"
+
+# rows written per transaction
+_BATCH = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    chain TEXT NOT NULL,
+    output TEXT NOT NULL
+)
+"""
+
+
+def content_hash(fname: str) -> str:
+    digest = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def chain_id(chain) -> str:
+    return json.dumps(chain)
+
+
+class Manifest:
+    def __init__(self, fname: str):
+        self._db = sqlite3.connect(fname)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+    def entries(self) -> Dict[str, Tuple]:
+        """
+        path: (size, mtime_ns, hash, chain, output), read in one query.
+        """
+        return {
+            row[0]: row[1:]
+            for row in self._db.execute("SELECT path, size, mtime_ns, hash, chain, output FROM entries")
+        }
+
+    def update(self, rows: List[Tuple]):
+        # one transaction, all of the rows or none of them
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def remove(self, paths: List[str]):
+        with self._db:
+            self._db.executemany("DELETE FROM entries WHERE path = ?", ((path,) for path in paths))
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+def _image_extensions():
+    return {"." + bytes(name).decode().lower() for name in QImageReader.supportedImageFormats()}
+
+
+def scan(root: str, extensions, exclude: str = None) -> Iterator[os.DirEntry]:
+    """
+    Image files under `root`, hidden ones and the `exclude` folder left out.
+    """
+    for entry in os.scandir(root):
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            if exclude is None or os.path.realpath(entry.path) != exclude:
+                yield from scan(entry.path, extensions, exclude)
+        elif os.path.splitext(entry.name)[1].lower() in extensions:
+            yield entry
+
+
+def _process_file(src: str, dst: str, chain) -> str:
+    # the hash is of the very bytes that were decoded, whatever lands later
+    with open(src, "rb") as f:
+        data = f.read()
+    image = QImage.fromData(data)
+    if image.isNull():
+        raise ValueError("Can't read `{}`".format(src))
+
+    result = apply_chain(pixels(image), chain)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = dst + ".tmp" + os.path.splitext(dst)[1]
+    try:
+        if not to_qimage(result).save(tmp):
+            raise IOError("Can't write `{}`".format(dst))
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return hashlib.sha1(data).hexdigest()
+
+
+class Watcher:
+    def __init__(self, src: str, dst: str, chain, workers: int = None, settle: float = 2,
+                 output_format: str = None):
+        self.src = os.path.abspath(src)
+        self.dst = os.path.abspath(dst)
+        if os.path.realpath(self.src) == os.path.realpath(self.dst):
+            raise ValueError("The output folder must not be the watched one")
+        self.chain = chain
+        self.settle = settle
+        self.output_format = output_format
+        os.makedirs(self.dst, exist_ok=True)
+        self.manifest = Manifest(os.path.join(self.dst, MANIFEST))
+        self._executor = ProcessPoolExecutor(workers, mp_context=_context())
+        self._extensions = _image_extensions()
+        # inputs that failed, not retried until they change
+        self._failed = {}
+        # outputs that several inputs map to, reported once
+        self._collisions = set()
+
+    def _output(self, relative: str) -> str:
+        if self.output_format:
+            relative = os.path.splitext(relative)[0] + "." + self.output_format
+        return os.path.join(self.dst, relative)
+
+    def pending(self) -> Tuple[List[Tuple], List[Tuple], List[str]]:
+        """
+        (files to process, rows to refresh without processing, removed paths)
+        """
+        known = self.manifest.entries()
+        chain = chain_id(self.chain)
+        now = time.time_ns()
+        todo, touched, seen = [], [], set()
+
+        # an output folder inside the watched one holds results, not inputs
+        entries = list(scan(self.src, self._extensions, os.path.realpath(self.dst)))
+        outputs = Counter(self._output(os.path.relpath(entry.path, self.src)) for entry in entries)
+
+        for entry in entries:
+            relative = os.path.relpath(entry.path, self.src)
+            seen.add(relative)
+            output = self._output(relative)
+            if outputs[output] > 1:
+                # e.g. a.png and a.jpg with --format png, neither one wins
+                if output not in self._collisions:
+                    self._collisions.add(output)
+                    print("{}: several inputs would be written there, skipped".format(output))
+                continue
+
+            stat = entry.stat()
+            if now - stat.st_mtime_ns < self.settle * 1e9:
+                continue  # still being written
+
+            if self._failed.get(relative) == (stat.st_size, stat.st_mtime_ns):
+                continue
+
+            row = known.get(relative)
+            if row is not None and row[3] == chain and os.path.exists(row[4]):
+                if row[:2] == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                digest = content_hash(entry.path)
+                if digest == row[2]:
+                    # touched or copied over with the same content
+                    touched.append((relative, stat.st_size, stat.st_mtime_ns, digest, chain, row[4]))
+                    continue
+
+            todo.append((relative, entry.path, output, stat))
+
+        removed = [path for path in known if path not in seen]
+        return todo, touched, removed
+
+    def run_once(self) -> int:
+        todo, touched, removed = self.pending()
+        if touched:
+            self.manifest.update(touched)
+        if removed:
+            self.manifest.remove(removed)
+
+        chain = chain_id(self.chain)
+        futures = {
+            self._executor.submit(_process_file, path, output, self.chain): (relative, output, stat)
+            for relative, path, output, stat in todo
+        }
+
+        rows, done = [], 0
+        for future in as_completed(futures):
+            relative, output, stat = futures[future]
+            try:
+                digest = future.result()
+            except Exception as e:
+                print("{}: {}".format(relative, e))
+                self._failed[relative] = stat.st_size, stat.st_mtime_ns
+                continue
+
+            rows.append((relative, stat.st_size, stat.st_mtime_ns, digest, chain, output))
+            done += 1
+            if len(rows) >= _BATCH:
+                self.manifest.update(rows)
+                rows = []
+
+        if rows:
+            self.manifest.update(rows)
+        return done
+
+    def watch(self, interval: float = 5):
+        while True:
+            done = self.run_once()
+            if done:
+                print("Processed {} file(s), {} in manifest".format(done, len(self.manifest)))
+            time.sleep(interval)
+
+    def close(self):
+        self._executor.shutdown()
+        self.manifest.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="folder to watch")
+    parser.add_argument("output", help="folder of the results, the manifest is kept there")
+    parser.add_argument("--op", action="append", default=[], help="operation[:arg,...]")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--format", default=None, help="extension of the outputs, e.g. png")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between passes")
+    parser.add_argument("--settle", type=float, default=2, help="skip files modified this recently")
+    parser.add_argument("--once", action="store_true", help="one pass and exit")
+    args = parser.parse_args()
+
+    watcher = Watcher(args.input, args.output, parse_chain(args.op), args.workers, args.settle, args.format)
+    try:
+        if args.once:
+            print("Processed {} file(s)".format(watcher.run_once()))
+        else:
+            watcher.watch(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+if __name__ == '__main__':
+    main()